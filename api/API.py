@@ -1,43 +1,133 @@
-from flask import Flask, jsonify, request
-from database import get_db_session
+import os
+import time
+
+from flask import Flask, Blueprint, current_app, jsonify, request, Response, stream_with_context
 from collections import OrderedDict
-from sqlalchemy import or_, distinct, create_engine
-from sqlalchemy import distinct
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, LargeBinary, UniqueConstraint, Text
-from sqlalchemy.orm import aliased, joinedload, scoped_session, sessionmaker
-from werkzeug.security import check_password_hash
+from loguru import logger
+from sqlalchemy import or_, text
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import SQLAlchemyError, NoResultFound
 from flask_cors import CORS  # Import CORS
 
-from models import Base, Reptile, Synonym, Comment, Common_Name, Distribution, Diagnosis, External_Link, Specimen, Etymology, Taxa, Biblio
-##from load_data import load_reptile
-
-class AdminUser(Base):
-    __tablename__ = 'admin_users'
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    username = Column(String, unique=True, nullable=False)
-    hashed_password = Column(String, nullable=False)
+import database
+from database import get_db_session
+from models import AdminUser, Reptile, Synonym, Taxa, Job
+from search import parse_filters, advanced_query
+from facets import get_facets, apply_reptiles
+from taxonomy import apply_taxon_counts, find_nodes, subtree_reptiles, taxonomy_tree, node_summary
+from autocomplete import name_index
+from bibliography import get_bib, bib_reptiles, search_bibs, page_limit
+from bulk import bulk_add, MAX_ITEMS
+from auth import admin_required, issue_token, check_secret, snapshot_unavailable, TOKEN_TTL
+from snapshot import fts_reptile_ids, has_fts
+from export import ndjson_chunks, csv_chunks, gzip_chunks, encode_chunks, CSV_TABLES, DEFAULT_CHUNK
+from changes import change_follower, record_changes, CREATE, UPDATE, DELETE, RELOAD
+from resolve import resolve_names, unindex_reptiles, MAX_NAMES
+from jobs import job_runner, enqueue, list_jobs, job_summary, HANDLERS, ANALYZE, ANALYZE_DELAY
+from update import validate_update, apply_update, touches, AGGREGATE_FIELDS, NAME_FIELDS
+
+## Routes live on a blueprint; create_app() builds the flask app around it
+
+api = Blueprint('api', __name__)
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def warm_up(app):
+    """ open the pool's connections and build the in-memory indexes before the first request """
+    started = time.perf_counter()
+    engine = database.get_engine()
+    wanted = int(app.config.get('REPTILEDB_WARMUP_CONNECTIONS', getattr(engine.pool, 'size', lambda: 1)()))
+    # hold them all at once so the pool really opens that many
+    connections = [engine.connect() for _ in range(max(wanted, 1))]
+    try:
+        for conn in connections:
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+    session = get_db_session()
+    try:
+        has_fts(session)
+        # follow the change log from before the build, so writes made until the first request are applied
+        change_follower.start(session)
+        name_index.ensure_built(session)
+    finally:
+        session.close()
+    logger.info(f"warm-up: {len(connections)} connections, name index ready in "
+                f"{(time.perf_counter() - started) * 1000:.0f} ms")
 
-    def __init__(self, username, password):
-        self.username = username
-        self.hashed_password = generate_password_hash(password)
 
-    def check_password(self, password):
-        return check_password_hash(self.hashed_password, password)
+def invalidate_caches(session, changes):
+    """ change-log subscriber: bring this worker's in-process caches up to date """
+    if any(op == RELOAD for _, op in changes):
+        name_index.invalidate()
+    else:
+        # a refresh of a deleted reptile simply drops it
+        name_index.refresh_reptiles(session, list(dict.fromkeys(rid for rid, _ in changes)))
 
-    def __repr__(self):
-        return f"<AdminUser(username={self.username})>"
 
+change_follower.subscribe(invalidate_caches)
 
-## Create the flask app 
 
-app = Flask(__name__)
-CORS(app)
+def follow_changes():
+    """ before_request hook: apply writes made by other workers, at most once per poll interval """
+    if not change_follower.due():
+        return
+    session = get_db_session()
+    try:
+        change_follower.poll(session)
+    except SQLAlchemyError as e:
+        logger.warning(f"change log poll failed: {e}")
+    finally:
+        session.close()
 
 
-def unique(items):
-    seen = set()
-    return [x for x in items if x not in seen and not seen.add(x)]
+def create_app(config=None):
+    """
+    build the flask app
+
+    config overrides the REPTILEDB_* settings from the environment.  Nothing
+    connects to the database until the first request, unless
+    REPTILEDB_WARMUP is set.  The background job runner is started with
+    REPTILEDB_JOB_THREADS threads (0 turns it off).
+
+    The database is per process: once an app exists, another create_app()
+    for a different database raises database.DatabaseInUse.
+    """
+    app = Flask(__name__)
+    app.config.update({name: os.getenv(name) for name in ('REPTILEDB_SECRET_KEY', 'REPTILEDB_WARMUP')})
+    app.config['REPTILEDB_TOKEN_TTL'] = TOKEN_TTL
+    app.config.update(config or {})
+    check_secret(app.config.get('REPTILEDB_SECRET_KEY'))
+    database.configure(app.config, claim=True)
+    CORS(app)
+    app.register_blueprint(api)
+    change_follower.interval = float(app.config.get('REPTILEDB_CHANGE_POLL') or os.getenv('REPTILEDB_CHANGE_POLL', 1.0))
+    app.before_request(follow_changes)
+    job_threads = app.config.get('REPTILEDB_JOB_THREADS')
+    job_runner.threads = int(job_threads if job_threads is not None else os.getenv('REPTILEDB_JOB_THREADS', 2))
+    job_runner.interval = float(app.config.get('REPTILEDB_JOB_POLL') or os.getenv('REPTILEDB_JOB_POLL', 2.0))
+    # a snapshot is read-only, there is nothing to maintain
+    if database.setting('REPTILEDB_USE_DB') != 'SNAPSHOT':
+        job_runner.start()
+    if _flag(app.config.get('REPTILEDB_WARMUP')):
+        warm_up(app)
+    return app
+
+
+def track_reptiles(session, reptiles, delta):
+    """ keep the aggregates in step with reptiles being added (1) or removed (-1) """
+    apply_reptiles(session, reptiles, delta)
+    changes = {}
+    for reptile in reptiles:
+        changes[reptile.taxa_id] = changes.get(reptile.taxa_id, 0) + delta
+    apply_taxon_counts(session, changes)
+
+def track_reptile(session, reptile, delta):
+    track_reptiles(session, [reptile], delta)
 
 def serialize_reptile(reptile):
     reptile_data = OrderedDict([
@@ -49,14 +139,14 @@ def serialize_reptile(reptile):
         ("subspecies_year", reptile.subspecies_year),
         ("IUCN", reptile.col17),
         ("taxa", reptile.taxa.value if reptile.taxa else None),
-        ("synonyms", unique([synonym.value for synonym in reptile.synonyms])),
-        ("comments", unique([comment.value for comment in reptile.comments])),
-        ("common_names", unique([common_name.value for common_name in reptile.common_names])),
-        ("distributions", unique([distribution.value for distribution in reptile.distributions])),
-        ("diagnoses", unique([diagnosis.value for diagnosis in reptile.diagnoses])),
-        ("external_links", unique([external_link.value for external_link in reptile.external_links])),
-        ("etymologies", unique([etymology.value for etymology in reptile.etymologies])),
-        ("specimens", unique([specimen.value for specimen in reptile.specimens])),
+        ("synonyms", [synonym.value for synonym in reptile.synonyms]),
+        ("comments", [comment.value for comment in reptile.comments]),
+        ("common_names", [common_name.value for common_name in reptile.common_names]),
+        ("distributions", [distribution.value for distribution in reptile.distributions]),
+        ("diagnoses", [diagnosis.value for diagnosis in reptile.diagnoses]),
+        ("external_links", [external_link.value for external_link in reptile.external_links]),
+        ("etymologies", [etymology.value for etymology in reptile.etymologies]),
+        ("specimens", [specimen.value for specimen in reptile.specimens]),
         ("bibliography", [{
             "bib_id": bib.bib_id,
             "bib_authors": bib.bib_authors,
@@ -68,7 +158,7 @@ def serialize_reptile(reptile):
     ])
     return reptile_data
 
-@app.route('/reptiles/<int:reptile_id>', methods=['GET'])
+@api.route('/reptiles/<int:reptile_id>', methods=['GET'])
 def get_reptile(reptile_id):
     session = get_db_session()
     reptile = session.query(Reptile).filter(Reptile.id == reptile_id).first()
@@ -80,28 +170,85 @@ def get_reptile(reptile_id):
         session.close()
         return jsonify({"error": "Reptile not found"}), 404
 
+@api.route('/reptiles/autocomplete', methods=['GET'])
+def autocomplete():
+    prefix = request.args.get('prefix', '')
+    try:
+        limit = min(int(request.args.get('limit', 10)), 100)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    if not name_index.built:
+        session = get_db_session()
+        try:
+            name_index.ensure_built(session)
+        finally:
+            session.close()
+    return jsonify(name_index.lookup(prefix, limit)), 200
+
+@api.route('/resolve', methods=['GET'])
+def resolve_name():
+    name = request.args.get('name', '').strip()
+    if not name:
+        return jsonify({"error": "name is required"}), 400
+
+    session = get_db_session()
+    try:
+        matches = resolve_names(session, [name])[name]
+        if not matches:
+            return jsonify({"name": name, "matches": [], "error": "Name not found"}), 404
+        return jsonify({"name": name, "matches": matches}), 200
+    finally:
+        session.close()
+
+@api.route('/resolve', methods=['POST'])
+def resolve_batch():
+    data = request.get_json(silent=True)
+    names = data.get('names') if isinstance(data, dict) else data
+    if not isinstance(names, list) or not names or not all(isinstance(n, str) for n in names):
+        return jsonify({"error": "Expected a non-empty list of names"}), 400
+    if len(names) > MAX_NAMES:
+        return jsonify({"error": f"At most {MAX_NAMES} names per request"}), 413
+
+    session = get_db_session()
+    try:
+        resolved = resolve_names(session, names)
+        results = [{"name": name, "matches": resolved[name]} for name in names]
+        return jsonify({
+            "resolved": sum(1 for r in results if r["matches"]),
+            "unresolved": sum(1 for r in results if not r["matches"]),
+            "results": results,
+        }), 200
+    finally:
+        session.close()
+
 # Add other routes here...
 
-@app.route('/hello',methods=['GET'])
+@api.route('/hello',methods=['GET'])
 def hello():
     return jsonify("Hello!"), 200
 
 
-@app.route('/reptiles/search/<string:query>', methods=['GET'])
+@api.route('/reptiles/search/<string:query>', methods=['GET'])
 def search_reptiles(query):
     session = get_db_session()
-    synonym_alias = aliased(Synonym)  # Creating an alias for the Synonym table to use in the join
-
-    # Explicitly joining Reptile with Synonym using an outer join to include reptiles that may not have synonyms
-    reptiles = session.query(Reptile).outerjoin(
-        synonym_alias, Reptile.id == synonym_alias.reptile_id
-    ).filter(
-        or_(
-            Reptile.subspecies_1.ilike(f"%{query}%"),
-            Reptile.subspecies_2.ilike(f"%{query}%"),
-            synonym_alias.value.ilike(f"%{query}%")
-        )
-    ).all()  # Using distinct() to avoid duplicate results due to the join
+    ids = fts_reptile_ids(session, query)
+    if ids is not None:
+        # snapshot replicas answer from the FTS index (word-prefix matches)
+        reptiles = session.query(Reptile).filter(Reptile.id.in_(ids)).order_by(Reptile.id).all() if ids else []
+    else:
+        synonym_alias = aliased(Synonym)  # Creating an alias for the Synonym table to use in the join
+
+        # Explicitly joining Reptile with Synonym using an outer join to include reptiles that may not have synonyms
+        reptiles = session.query(Reptile).outerjoin(
+            synonym_alias, Reptile.id == synonym_alias.reptile_id
+        ).filter(
+            or_(
+                Reptile.subspecies_1.ilike(f"%{query}%"),
+                Reptile.subspecies_2.ilike(f"%{query}%"),
+                synonym_alias.value.ilike(f"%{query}%")
+            )
+        ).all()  # Using distinct() to avoid duplicate results due to the join
 
     if reptiles:
         reptiles_data = [serialize_reptile(reptile) for reptile in reptiles]
@@ -112,7 +259,7 @@ def search_reptiles(query):
         return jsonify({"error": "No reptiles found matching the query"}), 404
 
     
-@app.route('/reptiles/search/subspeciesfinder/<string:query>', methods=['GET'])
+@api.route('/reptiles/search/subspeciesfinder/<string:query>', methods=['GET'])
 def search_reptiles_by_subspecies_finder(query):
     session = get_db_session()
     reptiles = session.query(Reptile).filter(
@@ -127,7 +274,7 @@ def search_reptiles_by_subspecies_finder(query):
         session.close()
         return jsonify({"error": "No reptiles found matching the query"}), 404
     
-@app.route('/reptiles/search/year/<int:year>', methods=['GET'])
+@api.route('/reptiles/search/year/<int:year>', methods=['GET'])
 def search_reptiles_by_year(year):
     session = get_db_session()
     reptiles = session.query(Reptile).filter(
@@ -142,12 +289,17 @@ def search_reptiles_by_year(year):
         session.close()
         return jsonify({"error": "No reptiles found matching the year"}), 404
     
-@app.route('/reptiles/search/taxa/<string:taxa_query>', methods=['GET'])
+@api.route('/reptiles/search/taxa/<string:taxa_query>', methods=['GET'])
 def search_reptiles_by_taxa(taxa_query):
     session = get_db_session()
-    reptiles = session.query(Reptile).join(Taxa).filter(
-        Taxa.value.ilike(f"%{taxa_query}%")
-    ).all()
+    # whole taxon names resolve through the tree; anything else is a substring match
+    nodes = find_nodes(session, taxa_query) if not taxa_query.isdigit() else []
+    if nodes:
+        reptiles = subtree_reptiles(session, nodes).all()
+    else:
+        reptiles = session.query(Reptile).join(Taxa).filter(
+            Taxa.value.ilike(f"%{taxa_query}%")
+        ).all()
 
     if reptiles:
         reptiles_data = [serialize_reptile(reptile) for reptile in reptiles]
@@ -157,180 +309,327 @@ def search_reptiles_by_taxa(taxa_query):
         session.close()
         return jsonify({"error": "No reptiles found matching the taxa"}), 404
 
+@api.route('/taxa/tree', methods=['GET'])
+def taxa_tree():
+    try:
+        depth = request.args.get('depth')
+        depth = int(depth) if depth is not None else None
+    except ValueError:
+        return jsonify({"error": "depth must be an integer"}), 400
+
+    session = get_db_session()
+    try:
+        tree = taxonomy_tree(session, request.args.get('root'), depth)
+        if tree is None:
+            return jsonify({"error": "Taxon not found"}), 404
+        return jsonify(tree), 200
+    finally:
+        session.close()
 
+@api.route('/taxa/<string:node>/reptiles', methods=['GET'])
+def taxa_reptiles(node):
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 500))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
 
+    session = get_db_session()
+    try:
+        nodes = find_nodes(session, node)
+        if not nodes:
+            return jsonify({"error": "Taxon not found"}), 404
+        reptiles = subtree_reptiles(session, nodes).offset(offset).limit(limit).all()
+        return jsonify({
+            "nodes": [node_summary(n) for n in nodes],
+            "species_count": sum(n.species_count for n in nodes),
+            "offset": offset,
+            "limit": limit,
+            "reptiles": [serialize_reptile(reptile) for reptile in reptiles],
+        }), 200
+    finally:
+        session.close()
 
 
-@app.route('/reptiles/search/advanced', methods=['GET'])
+@api.route('/reptiles/search/advanced', methods=['GET'])
 def advanced_search():
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    session = get_db_session()
+    try:
+        results = advanced_query(session, filters).all()
+        if results:
+            serialized_results = [serialize_reptile(reptile) for reptile in results]
+            return jsonify(serialized_results), 200
+        else:
+            return jsonify({"error": "No results found"}), 404
+    finally:
+        session.close()
+
+@api.route('/reptiles/facets', methods=['GET'])
+def reptile_facets():
+    try:
+        filters = parse_filters(request.args)
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     session = get_db_session()
-    query = session.query(Reptile)
+    try:
+        return jsonify(get_facets(session, filters, limit)), 200
+    finally:
+        session.close()
 
-    # Retrieve query parameters
-    taxa = request.args.get('higher-taxa')
-    genus = request.args.get('genus')
-    species = request.args.get('species')
-    subspecies = request.args.get('subspecies')
+@api.route('/bibliography/search', methods=['GET'])
+def bibliography_search():
+    try:
+        limit = page_limit(request.args.get('limit'))
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    q = request.args.get('q')
     author = request.args.get('author')
-    year = request.args.get('year')  # Get the year as a string
-    if year:
-        year = int(year)  # Convert year to an integer
-    common_name = request.args.get('common-name')
-    distribution = request.args.get('distribution')
-    types = request.args.get('types')
-    references = request.args.get('references')
-
-    # Dynamically build the query based on the presence of parameters
-    if taxa:
-        query = query.join(Taxa).filter(Taxa.value.ilike(f"%{taxa}%"))
-    if genus:
-    # Join with the Synonym table and filter on the synonym value
-        query = query.join(Reptile.synonyms).filter(Synonym.value.ilike(f"%{genus}%"))
-    if species:
-        query = query.filter(or_(
-            Reptile.subspecies_1.ilike(f"%{subspecies}%"),
-            Reptile.subspecies_2.ilike(f"%{subspecies}%")
-            ))
-    if subspecies:
-         query = query.filter(or_(
-            Reptile.subspecies_1.ilike(f"%{subspecies}%"),
-            Reptile.subspecies_2.ilike(f"%{subspecies}%")
-            ))
-    if author:
-        query = query.filter(Reptile.subspecies_finder.ilike(f"%{author}%"))
-    if year:
-        query = query.filter(Reptile.subspecies_year == year)
-    if common_name:
-        query = query.join(Common_Name).filter(Common_Name.value.ilike(f"%{common_name}%"))
-    if distribution:
-        query = query.join(Distribution).filter(Distribution.value.ilike(f"%{distribution}%"))
-    if types:
-        query = query.filter(Reptile.types.ilike(f"%{types}%"))
-    if references:
-        query = query.filter(Reptile.references.ilike(f"%{references}%"))
-
-    results = query.all()
-    if results:
-        # Correctly use the serialize_reptile function
-        serialized_results = [serialize_reptile(reptile) for reptile in results]
-        return jsonify(serialized_results), 200
-    else:
-        return jsonify({"error": "No results found"}), 404    
+    year = request.args.get('year')
+    if not (q or author or year):
+        return jsonify({"error": "Provide at least one of q, author or year"}), 400
+
+    session = get_db_session()
+    try:
+        page = search_bibs(session, q, author, year, request.args.get('after'), limit)
+        return jsonify(page), 200
+    finally:
+        session.close()
+
+@api.route('/bibliography/<string:bib_id>', methods=['GET'])
+def get_bibliography(bib_id):
+    session = get_db_session()
+    try:
+        bib = get_bib(session, bib_id)
+        if bib is None:
+            return jsonify({"error": "Reference not found"}), 404
+        return jsonify(bib), 200
+    finally:
+        session.close()
+
+@api.route('/bibliography/<string:bib_id>/reptiles', methods=['GET'])
+def get_bibliography_reptiles(bib_id):
+    try:
+        limit = page_limit(request.args.get('limit'))
+        after = request.args.get('after')
+        after = int(after) if after is not None else None
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers"}), 400
+
+    session = get_db_session()
+    try:
+        return jsonify(bib_reptiles(session, bib_id, after, limit)), 200
+    finally:
+        session.close()
 
 #Adding new reptile API call
-@app.route('/reptiles/add', methods=['POST'])
+@api.route('/reptiles/add', methods=['POST'])
+@admin_required
 def add_reptile_api():
     data = request.json
     session = get_db_session()
     try:
-        row_data = [
-        data.get('taxa'),
-        data.get('subspecies_1'),
-        data.get('subspecies_2'),
-        data.get('subspecies_finder'),
-        str(data.get('subspecies_year')),
-         data.get('col05', ''),  # Default to empty string if not provided,  # Assuming this is a string; adjust if it's a list
-        ", ".join(data.get('synonyms', [])),
-        data.get('col07', ''),  # Assuming this is a string; adjust if it's a list
-        ", ".join(data.get('common_names', [])),
-        ", ".join(data.get('distributions', [])),
-        "\n".join(data.get('comments', [])),  # Using newline for comments
-        ", ".join(data.get('diagnoses', [])),
-        ", ".join(data.get('specimens', [])),
-        "\n".join(data.get('external_links', [])),  # Newline for external links
-        ", ".join(data.get('bibliography_ids', [])),  # Adjust if this is not a list or handled differently
-        "\n".join(data.get('etymologies', [])),  # Newline for etymologies
-        data.get('col16'),  # Assuming this is a string; adjust if it's a list
-        data.get('col17'),  # Assuming this is a string; adjust if it's a list
-        data.get('reproduction'),  # Assuming this is a string; adjust if it's a list
-]
-        
-        # Load the reptile using the structured row_data
-        load_reptile(session, row_data)
+        created, results = bulk_add(session, [data])
+        if not created:
+            return jsonify({'error': 'Failed to add reptile', 'details': results[0].get('errors')}), 400
+        track_reptiles(session, created, 1)
+        record_changes(session, [results[0]['id']], CREATE)
+        enqueue(session, ANALYZE, key=ANALYZE, delay=ANALYZE_DELAY)
         session.commit()
-        return jsonify({'success': 'Reptile added successfully'}), 201
-    
+        name_index.refresh_reptiles(session, [results[0]['id']])
+        return jsonify({'success': 'Reptile added successfully', 'id': results[0]['id']}), 201
+
     except SQLAlchemyError as e:
         session.rollback()
         return jsonify({'error': 'Failed to add reptile', 'details': str(e)}), 400
-    
+
     finally:
         session.close()
 
-@app.route('/login', methods=['POST'])
+@api.route('/reptiles/bulk', methods=['POST'])
+@admin_required
+def bulk_add_reptiles():
+    data = request.get_json(silent=True)
+    items = data.get('reptiles') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty list of reptiles'}), 400
+    if len(items) > MAX_ITEMS:
+        return jsonify({'error': f'At most {MAX_ITEMS} reptiles per request'}), 413
+    atomic = _flag(request.args.get('atomic', ''))
+
+    session = get_db_session()
+    try:
+        created, results = bulk_add(session, items, atomic)
+        if created:
+            created_ids = [r['id'] for r in results if r['status'] == 'created']
+            track_reptiles(session, created, 1)
+            record_changes(session, created_ids, CREATE)
+            enqueue(session, ANALYZE, key=ANALYZE, delay=ANALYZE_DELAY)
+            session.commit()
+            name_index.refresh_reptiles(session, created_ids)
+        summary = {
+            'created': len(created),
+            'failed': len(items) - len(created),
+            'results': results,
+        }
+        return jsonify(summary), 201 if created else 400
+
+    except SQLAlchemyError as e:
+        session.rollback()
+        return jsonify({'error': 'Failed to add reptiles', 'details': str(e)}), 400
+
+    finally:
+        session.close()
+
+@api.route('/export', methods=['GET'])
+@admin_required
+def export_database():
+    fmt = request.args.get('format', 'ndjson')
+    table = request.args.get('table')
+    compress = _flag(request.args.get('gzip', ''))
+    try:
+        chunk = max(1, min(int(request.args.get('chunk', DEFAULT_CHUNK)), 5000))
+    except ValueError:
+        return jsonify({"error": "chunk must be an integer"}), 400
+    if fmt == 'csv' and table not in CSV_TABLES:
+        return jsonify({"error": "csv export needs table=<name>", "tables": list(CSV_TABLES)}), 400
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+
+    def generate():
+        session = get_db_session()
+        try:
+            chunks = ndjson_chunks(session, chunk) if fmt == 'ndjson' else csv_chunks(session, table, chunk)
+            yield from (gzip_chunks(chunks) if compress else encode_chunks(chunks))
+        finally:
+            session.close()
+
+    filename = 'reptiles.ndjson' if fmt == 'ndjson' else f'{table}.csv'
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    headers = {'Content-Disposition': f'attachment; filename="{filename}{".gz" if compress else ""}"'}
+    if compress:
+        mimetype = 'application/gzip'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+@api.route('/jobs', methods=['GET'])
+@admin_required
+def get_jobs():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    session = get_db_session()
+    try:
+        return jsonify(list_jobs(session, request.args.get('status'), limit)), 200
+    finally:
+        session.close()
+
+@api.route('/jobs/<int:job_id>', methods=['GET'])
+@admin_required
+def get_job(job_id):
+    session = get_db_session()
+    try:
+        job = session.get(Job, job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job_summary(job)), 200
+    finally:
+        session.close()
+
+@api.route('/jobs', methods=['POST'])
+@admin_required
+def add_job():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or data.get('kind') not in HANDLERS:
+        return jsonify({"error": "Expected {\"kind\": ...}", "kinds": sorted(HANDLERS)}), 400
+    params = data.get('params')
+    if params is not None and not isinstance(params, dict):
+        return jsonify({"error": "params must be an object"}), 400
+
+    session = get_db_session()
+    try:
+        job_id = enqueue(session, data['kind'], key=data.get('key', data['kind']), params=params)
+        session.commit()
+        return jsonify({"id": job_id}), 202
+    except SQLAlchemyError as e:
+        session.rollback()
+        return jsonify({'error': 'Failed to queue job', 'details': str(e)}), 400
+    finally:
+        session.close()
+
+@api.route('/login', methods=['POST'])
 def login():
+    unavailable = snapshot_unavailable()
+    if unavailable:
+        return unavailable
+
     # Extract username and password from the request
-    username = request.json.get('username')
-    password = request.json.get('password')
-    session = get_db_session()
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    password = data.get('password')
 
     if not username or not password:
         return jsonify({"error": "Missing username or password"}), 400
 
-    # Query your database for the user
-    admin_user = session.query(AdminUser).filter_by(username=username).first()
-
-    if admin_user and admin_user.check_password(password):
-        # If the check passes, return a success response
-        return jsonify({"message": "Login successful"}), 200
-    else:
-        # If the user doesn't exist or password is wrong
-        return jsonify({"error": "Invalid username or password"}), 401
+    ttl = int(current_app.config['REPTILEDB_TOKEN_TTL'])
+    session = get_db_session()
+    try:
+        # Query your database for the user
+        admin_user = session.query(AdminUser).filter_by(username=username).first()
+
+        # the only place the (deliberately slow) password hash is checked
+        if admin_user and admin_user.check_password(password):
+            return jsonify({
+                "message": "Login successful",
+                "token": issue_token(admin_user.username, ttl),
+                "token_type": "Bearer",
+                "expires_in": ttl,
+            }), 200
+        else:
+            # If the user doesn't exist or password is wrong
+            return jsonify({"error": "Invalid username or password"}), 401
+    finally:
+        session.close()
 
-@app.route('/reptiles/update/<int:reptile_id>', methods=['PUT'])
+@api.route('/reptiles/update/<int:reptile_id>', methods=['PUT', 'PATCH'])
+@admin_required
 def update_reptile(reptile_id):
-    data = request.json
+    data = request.get_json(silent=True)
+    errors = validate_update(data)
+    if errors:
+        return jsonify({'error': 'Invalid update', 'details': errors}), 400
+
     session = get_db_session()
     try:
         reptile = session.query(Reptile).filter_by(id=reptile_id).one()
-        
-        # Taxa handling
-        taxa_value = data.get('taxa')
-        if taxa_value:
-            taxa = session.query(Taxa).filter_by(value=taxa_value).one_or_none()
-            if not taxa:
-                taxa = Taxa(value=taxa_value)
-                session.add(taxa)
-            reptile.taxa = taxa
-
-        # Simple string fields
-        reptile.subspecies_1 = data.get('subspecies_1', reptile.subspecies_1)
-        reptile.subspecies_2 = data.get('subspecies_2', reptile.subspecies_2)
-        reptile.subspecies_finder = data.get('subspecies_finder', reptile.subspecies_finder)
-        reptile.subspecies_year = data.get('subspecies_year', reptile.subspecies_year)
-        reptile.reproduction = data.get('reproduction', reptile.reproduction)
-        reptile.col16 = data.get('col16', reptile.col16)
-        reptile.col17 = data.get('col17', reptile.col17)
-
-        # Binary fields
-        col05_data = data.get('col05')
-        if col05_data:
-            reptile.col05 = col05_data.encode('utf-16')
-
-        col07_data = data.get('col07')
-        if col07_data:
-            reptile.col07 = col07_data.encode('utf-16')
-
-        # List fields
-        def update_model_list(model, attr, data_key):
-            current_items = getattr(reptile, attr)
-            session.query(model).filter(model.reptile_id == reptile.id).delete()
-            new_items = [model(value=item) for item in data.get(data_key, [])]
-            setattr(reptile, attr, new_items)
-
-        update_model_list(Synonym, 'synonyms', 'synonyms')
-        update_model_list(Common_Name, 'common_names', 'common_names')
-        update_model_list(Distribution, 'distributions', 'distributions')
-        update_model_list(Comment, 'comments', 'comments')
-        update_model_list(Diagnosis, 'diagnoses', 'diagnoses')
-        update_model_list(External_Link, 'external_links', 'external_links')
-        update_model_list(Specimen, 'specimens', 'specimens')
-        update_model_list(Etymology, 'etymologies', 'etymologies')
+
+        # only lists and fields present in the request are touched
+        aggregates = any(field in data for field in AGGREGATE_FIELDS)
+        if aggregates:
+            track_reptile(session, reptile, -1)
+        changes = apply_update(session, reptile, data)
+        session.flush()
+        if aggregates:
+            track_reptile(session, reptile, 1)
+        if changes:
+            record_changes(session, [reptile_id], UPDATE)
+            enqueue(session, ANALYZE, key=ANALYZE, delay=ANALYZE_DELAY)
 
         # Commit the transaction
         session.commit()
-        return jsonify({'success': 'Reptile updated successfully'}), 200
-    
+        if touches(changes, NAME_FIELDS):
+            name_index.refresh_reptiles(session, [reptile_id])
+        return jsonify({'success': 'Reptile updated successfully', 'changes': changes}), 200
+
+    except NoResultFound:
+        return jsonify({'error': 'Reptile not found'}), 404
     except SQLAlchemyError as e:
         session.rollback()
         return jsonify({'error': 'Failed to update reptile', 'details': str(e)}), 400
@@ -340,22 +639,28 @@ def update_reptile(reptile_id):
     finally:
         session.close()
 
-@app.route('/reptiles/delete/<int:reptile_id>', methods=['DELETE'])
+@api.route('/reptiles/delete/<int:reptile_id>', methods=['DELETE'])
+@admin_required
 def delete_reptile(reptile_id):
     session = get_db_session()
     try:
         reptile = session.query(Reptile).filter_by(id=reptile_id).one()
+        track_reptile(session, reptile, -1)
+        unindex_reptiles(session, [reptile_id])
         session.delete(reptile)
+        record_changes(session, [reptile_id], DELETE)
+        enqueue(session, ANALYZE, key=ANALYZE, delay=ANALYZE_DELAY)
         session.commit()
+        name_index.remove_reptiles([reptile_id])
         return jsonify({'success': 'Reptile deleted successfully'}), 200
+    except NoResultFound:
+        return jsonify({'error': 'Reptile not found'}), 404
     except SQLAlchemyError as e:
         session.rollback()
         return jsonify({'error': 'Failed to delete reptile', 'details': str(e)}), 400
-    except NoResultFound:
-        return jsonify({'error': 'Reptile not found'}), 404
     finally:
         session.close()
 
 
 if __name__ == '__main__':
-    app.run(debug=True,host="0.0.0.0")
+    create_app().run(debug=True,host="0.0.0.0")
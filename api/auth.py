@@ -0,0 +1,122 @@
+"""
+Signed admin tokens.
+
+/login checks the password hash once and hands out a short-lived token:
+
+    base64url(payload JSON) "." base64url(HMAC-SHA256(secret, payload))
+
+with payload {"sub": username, "exp": unix time}.  Verifying a token is a
+single HMAC and a constant-time compare, with no database round-trip, so
+admin clients send ``Authorization: Bearer <token>`` on every write
+instead of credentials.
+
+The secret is REPTILEDB_SECRET_KEY from the app config or the environment.
+Placeholder values such as "change-me" are refused at startup.  Without
+a secret a random one is generated at startup, which means tokens
+stop working after a restart and are not shared between worker processes.
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+from functools import wraps
+
+from flask import g, jsonify, request, current_app, has_app_context
+
+from database import setting
+
+TOKEN_TTL = int(os.getenv('REPTILEDB_TOKEN_TTL', 3600))
+
+# sample values that must never sign real tokens
+PLACEHOLDER_SECRETS = ("change-me", "changeme", "secret")
+
+# used when neither the app config nor the environment provides a secret
+_process_secret = secrets.token_bytes(32)
+
+
+def signing_secret():
+    """ REPTILEDB_SECRET_KEY from the app config or the environment, else the per-process secret """
+    secret = current_app.config.get("REPTILEDB_SECRET_KEY") if has_app_context() else None
+    secret = secret or os.getenv("REPTILEDB_SECRET_KEY")
+    check_secret(secret)
+    return secret.encode("utf-8") if secret else _process_secret
+
+
+def check_secret(secret):
+    """ refuse a placeholder REPTILEDB_SECRET_KEY, anyone could forge admin tokens with it """
+    if secret and secret.strip().lower() in PLACEHOLDER_SECRETS:
+        raise ValueError("REPTILEDB_SECRET_KEY is a placeholder; set it to a long random value or leave it empty")
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload, secret):
+    return _b64encode(hmac.new(secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(username, ttl=TOKEN_TTL, secret=None, now=None):
+    """ a signed token for username that expires after ttl seconds """
+    secret = secret or signing_secret()
+    now = time.time() if now is None else now
+    claims = {"sub": username, "exp": int(now) + ttl}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload, secret)}"
+
+
+def verify_token(token, secret=None, now=None):
+    """ the username in a valid, unexpired token, otherwise None """
+    secret = secret or signing_secret()
+    try:
+        payload, signature = token.split(".")
+        expected = _sign(payload, secret)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature.encode("ascii", "replace"), expected.encode("ascii")):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    now = time.time() if now is None else now
+    if not isinstance(claims, dict) or not isinstance(claims.get("exp"), int) or claims["exp"] <= now:
+        return None
+    return claims.get("sub")
+
+
+def bearer_token():
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+
+def snapshot_unavailable():
+    """ the 503 for login and admin routes on a read-only snapshot (it has no admin_users), else None """
+    if setting("REPTILEDB_USE_DB") != "SNAPSHOT":
+        return None
+    return jsonify({"error": "Admin access is not available on a read-only snapshot"}), 503
+
+
+def admin_required(view):
+    """ route decorator: reject requests without a valid admin token """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        unavailable = snapshot_unavailable()
+        if unavailable:
+            return unavailable
+        username = verify_token(bearer_token())
+        if username is None:
+            response = jsonify({"error": "Admin token missing, invalid or expired"})
+            response.headers["WWW-Authenticate"] = "Bearer"
+            return response, 401
+        g.admin = username
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,167 @@
+"""
+In-memory prefix index for typeahead.
+
+Genus, binomial, synonym and common names are normalized (lower case,
+accents stripped, whitespace collapsed) and kept in one sorted array, so a
+prefix lookup is a binary search followed by a short forward scan.  Each
+distinct (name, kind) entry carries the set of reptile ids it belongs to.
+
+The index is built lazily on first use and patched one reptile at a time
+by the write endpoints.  Updates build a new snapshot and swap it in, so
+readers never take a lock.
+"""
+import re
+import bisect
+import threading
+import unicodedata
+
+from sqlalchemy import select
+
+from models import Reptile, Synonym, Common_Name
+
+KIND_ORDER = {"species": 0, "genus": 1, "synonym": 2, "common_name": 3}
+MAX_IDS = 25
+
+_SPACES = re.compile(r"\s+")
+_LANGUAGE = re.compile(r"^[A-Z][a-zA-Z]{0,2}:\s*")
+
+
+def normalize(text):
+    """ lower case, accent-free, single-spaced form of text used as the index key """
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _SPACES.sub(" ", text).strip().lower()[:255]
+
+
+def _reptile_names(genus, species):
+    names = []
+    if genus:
+        names.append(("genus", genus))
+        if species:
+            names.append(("species", f"{genus} {species}"))
+    return names
+
+
+def _synonym_name(value):
+    return ("synonym", value.strip()[:255]) if value and value.strip() else None
+
+
+def _common_name(value):
+    value = _LANGUAGE.sub("", value or "").strip()
+    return ("common_name", value[:255]) if value else None
+
+
+def _collect(session, reptile_ids=None):
+    """ {reptile_id: [(kind, name), ...]} for all or some reptiles """
+    out = {}
+
+    q = select(Reptile.id, Reptile.subspecies_1, Reptile.subspecies_2)
+    if reptile_ids is not None:
+        q = q.where(Reptile.id.in_(reptile_ids))
+    for rid, genus, species in session.execute(q):
+        out.setdefault(rid, []).extend(_reptile_names(genus, species))
+
+    for model, to_name in ((Synonym, _synonym_name), (Common_Name, _common_name)):
+        q = select(model.reptile_id, model.value).where(model.reptile_id.is_not(None))
+        if reptile_ids is not None:
+            q = q.where(model.reptile_id.in_(reptile_ids))
+        for rid, value in session.execute(q):
+            name = to_name(value)
+            if name:
+                out.setdefault(rid, []).append(name)
+    return out
+
+
+class NameIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (sorted keys, (kind, name) per key, (key, kind, name) -> frozenset of ids)
+        self._snapshot = ([], [], {})
+        self._by_reptile = {}    # reptile id -> list of (key, kind, name)
+        self.built = False
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    def _publish(self, ids):
+        triples = sorted(ids, key=lambda t: (t[0], KIND_ORDER.get(t[1], 9), t[2]))
+        keys = [key for key, _, _ in triples]
+        entries = [(kind, name) for _, kind, name in triples]
+        self._snapshot = (keys, entries, ids)
+
+    def _add(self, ids, rid, pairs):
+        for kind, name in pairs:
+            triple = (normalize(name), kind, name)
+            ids[triple] = ids.get(triple, frozenset()) | {rid}
+            self._by_reptile.setdefault(rid, []).append(triple)
+
+    def _drop(self, ids, rid):
+        for triple in self._by_reptile.pop(rid, []):
+            owners = ids.get(triple, frozenset()) - {rid}
+            if owners:
+                ids[triple] = owners
+            else:
+                ids.pop(triple, None)
+
+    def build(self, session):
+        """ (re)build the whole index from the database """
+        names = _collect(session)
+        owners, by_reptile = {}, {}
+        for rid, pairs in names.items():
+            for kind, name in pairs:
+                triple = (normalize(name), kind, name)
+                owners.setdefault(triple, set()).add(rid)
+                by_reptile.setdefault(rid, []).append(triple)
+        with self._lock:
+            self._by_reptile = by_reptile
+            self._publish({triple: frozenset(rids) for triple, rids in owners.items()})
+            self.built = True
+
+    def invalidate(self):
+        """ rebuild from the database on next use; the current entries are served until then """
+        self.built = False
+
+    def ensure_built(self, session):
+        if not self.built:
+            self.build(session)
+
+    def refresh_reptiles(self, session, reptile_ids):
+        """ re-read the given reptiles after an add or update """
+        if not self.built:
+            return
+        names = _collect(session, list(reptile_ids))
+        with self._lock:
+            ids = dict(self._snapshot[2])
+            for rid in reptile_ids:
+                self._drop(ids, rid)
+                self._add(ids, rid, names.get(rid, []))
+            self._publish(ids)
+
+    def remove_reptiles(self, reptile_ids):
+        """ forget deleted reptiles """
+        if not self.built:
+            return
+        with self._lock:
+            ids = dict(self._snapshot[2])
+            for rid in reptile_ids:
+                self._drop(ids, rid)
+            self._publish(ids)
+
+    def lookup(self, prefix, limit=10):
+        """ up to limit entries whose normalized name starts with prefix """
+        key = normalize(prefix)
+        if not key:
+            return []
+        keys, entries, ids = self._snapshot
+        results = []
+        i = bisect.bisect_left(keys, key)
+        while i < len(keys) and len(results) < limit and keys[i].startswith(key):
+            kind, name = entries[i]
+            owners = sorted(ids.get((keys[i], kind, name), ()))
+            results.append({"name": name, "kind": kind, "count": len(owners), "ids": owners[:MAX_IDS]})
+            i += 1
+        return results
+
+
+name_index = NameIndex()
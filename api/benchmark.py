@@ -0,0 +1,621 @@
+"""
+HTTP load-testing and latency benchmark harness for the API.
+
+Seeds a SQLite database with synthetic reptiles, starts the API under waitress
+on localhost in a child process and drives a mix of detail and search requests
+at one or more concurrency levels.
+
+Usage (from the api directory):
+
+    python benchmark.py run --reptiles 2000 --children 5 --concurrency 1,4,16 --output results.json
+    python benchmark.py seed --db bench.db --reptiles 5000
+    python benchmark.py compare before.json after.json
+    python benchmark.py plans --step 2 --output plans.json
+    python benchmark.py startup --db bench.db --budget-ms 1500
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+from loguru import logger
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+
+# relative weight of each request kind in the traffic mix
+DEFAULT_MIX = {
+    "detail": 50,
+    "search": 15,
+    "search_finder": 5,
+    "search_year": 10,
+    "search_taxa": 5,
+    "advanced": 15,
+}
+
+GENERA = ["Gekko", "Anolis", "Lygodactylus", "Sphenomorphus", "Atractus", "Cyrtodactylus",
+          "Liolaemus", "Hemidactylus", "Tantilla", "Oligodon", "Zonosaurus", "Ablepharus"]
+AUTHORS = ["LINNAEUS", "GRAY", "BOULENGER", "COPE", "PETERS", "DUMERIL & BIBRON",
+           "WIEGMANN", "SMITH", "BRYGOO", "WETTSTEIN", "BAUER", "UETZ"]
+TAXA = [
+    "Gekkonidae, Gekkota, Sauria, Squamata (lizards: geckos)",
+    "Scincidae, Eugongylinae (Eugongylini), Scincoidea, Sauria, Squamata (lizards)",
+    "Agamidae (Agaminae), Sauria, Iguania, Squamata (lizards)",
+    "Dactyloidae, Iguania, Sauria, Squamata (lizards)",
+    "Colubridae (Colubrinae), Colubroidea, Caenophidia, Alethinophidia, Serpentes, Squamata (snakes)",
+    "Dipsadidae, Colubroidea, Caenophidia, Alethinophidia, Serpentes, Squamata (snakes)",
+    "Gerrhosauridae (Zonosaurinae), Scincoidea, Sauria, Squamata (lizards)",
+]
+REGIONS = ["Madagascar", "Turkey", "Iran", "Azerbaijan", "Armenia", "Brazil", "Colombia",
+           "Ecuador", "Peru", "Mexico", "Thailand", "Myanmar", "Vietnam", "Australia",
+           "Indonesia", "Philippines", "Kenya", "Tanzania", "South Africa", "India"]
+SYLLABLES = ["ka", "lo", "mi", "ra", "te", "su", "vi", "no", "pe", "ga", "ri", "to", "ba", "le"]
+
+
+def fake_epithet(rnd):
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))) + rnd.choice(["us", "a", "i", "ensis", "ae"])
+
+
+def seed_database(path, reptiles=1000, children=5, seed=42):
+    """ create a SQLite database at path filled with synthetic reptiles """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base, Reptile, Synonym, Comment, Common_Name, Distribution, Diagnosis, \
+        External_Link, Specimen, Etymology, Taxa, Biblio
+    from dedupe import child_values
+
+    def rows(model, values):
+        # the child tables are unique per (reptile, value)
+        return [model(value) for value in child_values(model, list(values))]
+
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    taxa = [Taxa([value]) for value in TAXA]
+    session.add_all(taxa)
+
+    bibs = []
+    for i in range(max(10, reptiles // 2)):
+        bib = Biblio([str(10000 + i), f"{rnd.choice(AUTHORS).title()}, A.", str(rnd.randint(1758, 2023)),
+                      f"A review of the genus {rnd.choice(GENERA)} " + " ".join(fake_epithet(rnd) for _ in range(8)),
+                      "Zootaxa", f"https://example.org/bib/{i}"])
+        bibs.append(bib)
+    session.add_all(bibs)
+
+    seen = set()
+    started = time.perf_counter()
+    for i in range(reptiles):
+        genus = rnd.choice(GENERA)
+        species = fake_epithet(rnd)
+        while (genus, species) in seen:
+            species = fake_epithet(rnd)
+        seen.add((genus, species))
+        author = rnd.choice(AUTHORS)
+        year = rnd.randint(1758, 2023)
+        reptile = Reptile([None, genus, species, author, year, f"({author} {year})",
+                           None, None, None, None, None, None, None, None, None, None,
+                           str(i), str(100000 + i), "oviparous"])
+        reptile.taxa = rnd.choice(taxa)
+        n = max(1, int(rnd.expovariate(1 / children))) if children else 0
+        reptile.synonyms = rows(Synonym, (f"{rnd.choice(GENERA)} {species} {rnd.choice(AUTHORS)} {rnd.randint(1758, 2023)}"
+                                          for _ in range(n)))
+        reptile.common_names = rows(Common_Name, (f"E: {species.title()} {rnd.choice(['Gecko', 'Skink', 'Snake', 'Anole'])}"
+                                                  for _ in range(max(1, n // 2))))
+        reptile.distributions = rows(Distribution, (", ".join(rnd.sample(REGIONS, rnd.randint(1, 4)))
+                                                    for _ in range(max(1, n // 2))))
+        reptile.comments = rows(Comment, (" ".join(fake_epithet(rnd) for _ in range(40)) for _ in range(max(1, n // 3))))
+        reptile.diagnoses = rows(Diagnosis, (" ".join(fake_epithet(rnd) for _ in range(200)) for _ in range(max(1, n // 3))))
+        reptile.external_links = rows(External_Link, (f"https://example.org/{genus}/{species}/{j}" for j in range(max(1, n // 3))))
+        reptile.specimens = rows(Specimen, (f"Holotype: ZSM {rnd.randint(1, 9999)}/{year}" for _ in range(max(1, n // 3))))
+        reptile.etymologies = rows(Etymology, (f"Named after {rnd.choice(REGIONS)}." for _ in range(1)))
+        reptile.bibliography = rnd.sample(bibs, min(len(bibs), rnd.randint(1, 6)))
+        session.add(reptile)
+        if i % 500 == 499:
+            session.flush()
+    session.commit()
+    session.close()
+    # stamp the schema and build the derived tables (facets, taxonomy, regions, names) like a real load
+    import migrations
+    migrations.upgrade(engine)
+    engine.dispose()
+    logger.info(f"seeded {reptiles} reptiles into {path} in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+def sample_targets(path, limit=500):
+    """ pull ids and search terms from an existing database to drive requests """
+    from sqlalchemy import create_engine, select, func
+    from models import Reptile, Taxa, Distribution
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(Reptile.id, Reptile.subspecies_1, Reptile.subspecies_2, Reptile.subspecies_finder,
+                   Reptile.subspecies_year).order_by(func.random()).limit(limit)
+        ).all()
+        taxa = conn.execute(select(Taxa.value)).scalars().all()
+        dists = conn.execute(select(Distribution.value).limit(limit)).scalars().all()
+    engine.dispose()
+    if not rows:
+        raise SystemExit(f"no reptiles found in {path}")
+    return {
+        "ids": [r.id for r in rows],
+        "genera": sorted({r.subspecies_1 for r in rows if r.subspecies_1}),
+        "species": [r.subspecies_2 for r in rows if r.subspecies_2],
+        "authors": sorted({r.subspecies_finder for r in rows if r.subspecies_finder}),
+        "years": sorted({r.subspecies_year for r in rows if r.subspecies_year}),
+        "taxa": sorted({part.strip() for value in taxa for part in value.split(",")}),
+        "regions": sorted({d.split(",")[0].strip() for d in dists if d}) or ["Madagascar"],
+    }
+
+
+def build_requests(targets, count, mix=None, seed=42):
+    """ return a list of (kind, path) tuples following the traffic mix """
+    mix = mix or DEFAULT_MIX
+    rnd = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    out = []
+    for kind in rnd.choices(kinds, weights=weights, k=count):
+        if kind == "detail":
+            path = f"/reptiles/{rnd.choice(targets['ids'])}"
+        elif kind == "search":
+            term = rnd.choice(targets["species"])
+            path = f"/reptiles/search/{quote(term[:rnd.randint(4, max(4, len(term)))])}"
+        elif kind == "search_finder":
+            path = f"/reptiles/search/subspeciesfinder/{quote(rnd.choice(targets['authors']))}"
+        elif kind == "search_year":
+            path = f"/reptiles/search/year/{rnd.choice(targets['years'])}"
+        elif kind == "search_taxa":
+            path = f"/reptiles/search/taxa/{quote(rnd.choice(targets['taxa']))}"
+        else:
+            params = {}
+            if rnd.random() < 0.6:
+                params["genus"] = rnd.choice(targets["genera"])
+            if rnd.random() < 0.4:
+                params["year"] = rnd.choice(targets["years"])
+            if rnd.random() < 0.3:
+                params["distribution"] = rnd.choice(targets["regions"])
+            if rnd.random() < 0.3 or not params:
+                params["author"] = rnd.choice(targets["authors"])
+            path = f"/reptiles/search/advanced?{urlencode(params)}"
+        out.append((kind, path))
+    return out
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples, elapsed):
+    latencies = [s["ms"] for s in samples]
+    queries = [s["queries"] for s in samples if s["queries"] is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s["status"] >= 500 or s["status"] == 0),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def drive(host, port, plan, concurrency, timeout=30):
+    """ issue the planned requests with the given concurrency, return per-request samples """
+    local = threading.local()
+
+    def one(item):
+        kind, path = item
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+            queries = resp.getheader(QUERY_COUNT_HEADER)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            local.conn = None
+            status, queries = 0, None
+        return {
+            "kind": kind,
+            "status": status,
+            "ms": (time.perf_counter() - started) * 1000.0,
+            "queries": int(queries) if queries is not None else None,
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, plan))
+    return samples, time.perf_counter() - started
+
+
+def wait_for_server(host, port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"API server exited with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request("GET", "/hello")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit("API server did not start in time")
+
+
+def start_server(db_path, host, port, threads):
+    env = dict(os.environ, REPTILEDB_USE_DB="SQLITE", REPTILEDB_SQLITE=os.path.abspath(db_path))
+    cmd = [sys.executable, os.path.abspath(__file__), "serve", "--host", host, "--port", str(port),
+           "--threads", str(threads)]
+    return subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(host, port, threads):
+    """ run the API under waitress with per-request query counting """
+    import logging
+    from sqlalchemy import event
+    from waitress import serve as waitress_serve
+    from API import create_app
+    from database import engine
+
+    app = create_app()
+
+    counter = threading.local()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter.queries = getattr(counter, "queries", 0) + 1
+
+    @app.before_request
+    def reset_query_count():
+        counter.queries = 0
+
+    @app.after_request
+    def add_query_count(response):
+        response.headers[QUERY_COUNT_HEADER] = str(getattr(counter, "queries", 0))
+        return response
+
+    # queue depth warnings are expected while the server is saturated
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)
+    waitress_serve(app, host=host, port=port, threads=threads, _quiet=True)
+
+
+def run(args):
+    db_path = args.db
+    tmpdir = None
+    if not db_path:
+        tmpdir = tempfile.mkdtemp(prefix="reptiledb-bench-")
+        db_path = os.path.join(tmpdir, "bench.db")
+    if not os.path.exists(db_path) or args.reseed:
+        seed_database(db_path, args.reptiles, args.children, args.seed)
+
+    targets = sample_targets(db_path)
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    proc = start_server(db_path, args.host, args.port, args.threads)
+    results = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "label": args.label,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": {"path": db_path, "reptiles": args.reptiles, "children": args.children},
+        "server_threads": args.threads,
+        "mix": DEFAULT_MIX,
+        "levels": [],
+    }
+    try:
+        wait_for_server(args.host, args.port, proc)
+        if args.warmup:
+            drive(args.host, args.port, build_requests(targets, args.warmup, seed=args.seed + 1), max(levels))
+        for level in levels:
+            plan = build_requests(targets, args.requests, seed=args.seed + level)
+            samples, elapsed = drive(args.host, args.port, plan, level)
+            by_kind = {}
+            for s in samples:
+                by_kind.setdefault(s["kind"], []).append(s)
+            entry = {
+                "concurrency": level,
+                "elapsed_s": round(elapsed, 3),
+                "overall": summarize(samples, elapsed),
+                "endpoints": {kind: summarize(items, elapsed) for kind, items in sorted(by_kind.items())},
+            }
+            results["levels"].append(entry)
+            o = entry["overall"]
+            logger.info(f"c={level:<3} rps={o['throughput_rps']:<8} p50={o['p50_ms']}ms p95={o['p95_ms']}ms "
+                        f"p99={o['p99_ms']}ms q/req={o['queries_per_request']} errors={o['errors']}")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"results written to {args.output}")
+    return results
+
+
+def explain(conn, statement, parameters):
+    """ query plan rows for one captured statement """
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+    return [f"{r.get('table')}: type={r.get('type')} key={r.get('key')} rows={r.get('rows')}" for r in rows]
+
+
+def capture_plans(client, engine, paths, repeat):
+    """ run each endpoint once to capture its SQL, explain it and time it """
+    from sqlalchemy import event
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    report = {}
+    try:
+        for kind, path in paths:
+            captured.clear()
+            client.get(path)
+            statements = list(dict.fromkeys((s, tuple(p) if isinstance(p, (list, tuple)) else p)
+                                            for s, p in captured if s.lstrip().upper().startswith("SELECT")))
+            started = time.perf_counter()
+            for _ in range(repeat):
+                client.get(path)
+            elapsed = (time.perf_counter() - started) / repeat * 1000.0
+            captured.clear()
+            with engine.connect() as conn:
+                plans = [{"sql": " ".join(s.split())[:300], "plan": explain(conn, s, p)}
+                         for s, p in statements]
+            report[kind] = {
+                "path": path,
+                "mean_ms": round(elapsed, 3),
+                "queries": len(statements),
+                "full_scans": sum(1 for p in plans for line in p["plan"] if line.startswith("SCAN")),
+                "statements": plans,
+            }
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return report
+
+
+def index_map(conn):
+    """ {(table, index name): (columns, unique)} for every index in the database """
+    from sqlalchemy import inspect
+
+    inspector = inspect(conn)
+    return {(table, ix["name"]): (tuple(ix["column_names"]), bool(ix["unique"]))
+            for table in inspector.get_table_names() for ix in inspector.get_indexes(table)}
+
+
+def superseding_indexes(engine, step_up, step_down):
+    """ indexes from later steps that lead with the same column as an index the step adds """
+    with engine.begin() as conn:
+        before = index_map(conn)
+    with engine.begin() as conn:
+        step_up(conn)
+    with engine.begin() as conn:
+        added = [(table, columns[0]) for (table, name), (columns, _) in index_map(conn).items()
+                 if (table, name) not in before and columns]
+    with engine.begin() as conn:
+        step_down(conn)
+    return {key: spec for key, spec in before.items() if spec[0] and (key[0], spec[0][0]) in added}
+
+
+def plans(args):
+    """ per-endpoint query plans before and after one migration step """
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="reptiledb-plans-"), "plans.db")
+    if not os.path.exists(db_path):
+        seed_database(db_path, args.reptiles, args.children, args.seed)
+    os.environ["REPTILEDB_USE_DB"] = "SQLITE"
+    os.environ["REPTILEDB_SQLITE"] = os.path.abspath(db_path)
+
+    from API import create_app
+    from database import engine
+    import migrations
+
+    app = create_app()
+    migrations.upgrade(engine)
+    number, description, (step_up, step_down) = next(m for m in migrations.MIGRATIONS if m[0] == args.step)
+    targets = sample_targets(db_path)
+    paths = list({kind: path for kind, path in reversed(build_requests(targets, 200, seed=args.seed))}.items())
+    client = app.test_client()
+
+    with engine.begin() as conn:
+        step_down(conn)
+    # a later index leading with the same column would hide what the step changes
+    superseded = superseding_indexes(engine, step_up, step_down)
+    with engine.begin() as conn:
+        for table, name in superseded:
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+    # pooled sqlite connections cache prepared statements, and EXPLAIN does not notice schema changes
+    engine.dispose()
+    before = capture_plans(client, engine, paths, args.repeat)
+    with engine.begin() as conn:
+        for (table, name), (columns, unique) in superseded.items():
+            conn.exec_driver_sql(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})")
+        step_up(conn)
+    engine.dispose()
+    after = capture_plans(client, engine, paths, args.repeat)
+    # later steps are idempotent; rerunning them restores the current schema
+    with engine.begin() as conn:
+        for later, _, (later_up, _) in migrations.MIGRATIONS:
+            if later > number:
+                later_up(conn)
+
+    print(f"migration {number}: {description}")
+    print(f"{'endpoint':<16} {'scans before':>12} {'scans after':>12} {'ms before':>10} {'ms after':>10}")
+    for kind, _ in sorted(paths):
+        b, a = before[kind], after[kind]
+        print(f"{kind:<16} {b['full_scans']:>12} {a['full_scans']:>12} {b['mean_ms']:>10} {a['mean_ms']:>10}")
+
+    results = {"migration": number, "description": description, "database": db_path,
+               "before": before, "after": after}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"plans written to {args.output}")
+    return results
+
+
+# run in a fresh interpreter: import, build the app, then serve one request
+STARTUP_PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+import API
+imported = time.perf_counter()
+app = API.create_app({"REPTILEDB_WARMUP": sys.argv[1]})
+created = time.perf_counter()
+status = app.test_client().get(sys.argv[2]).status_code
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "create_app_ms": (created - imported) * 1000,
+                  "first_request_ms": (served - created) * 1000, "status": status}))
+"""
+
+
+def startup(args):
+    """ import, app creation and first-request times in fresh processes, checked against a budget """
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="reptiledb-startup-"), "startup.db")
+    if not os.path.exists(db_path):
+        seed_database(db_path, args.reptiles, args.children, args.seed)
+    env = dict(os.environ, REPTILEDB_USE_DB="SQLITE", REPTILEDB_SQLITE=os.path.abspath(db_path))
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    results = {}
+    for mode, warm in (("cold", "0"), ("warm", "1")):
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, "-c", STARTUP_PROBE, warm, args.path], env=env, cwd=cwd,
+                                 capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        summary = {key: round(percentile(sorted(r[key] for r in runs), 50), 1)
+                   for key in ("import_ms", "create_app_ms", "first_request_ms")}
+        summary["ready_ms"] = round(summary["import_ms"] + summary["create_app_ms"], 1)
+        summary["statuses"] = sorted({r["status"] for r in runs})
+        results[mode] = summary
+
+    print(f"{'mode':<6} {'import':>9} {'create_app':>11} {'ready':>9} {'first req':>10}   (median ms, {args.repeat} runs)")
+    for mode, s in results.items():
+        print(f"{mode:<6} {s['import_ms']:>9} {s['create_app_ms']:>11} {s['ready_ms']:>9} {s['first_request_ms']:>10}")
+    over = results["cold"]["ready_ms"] > args.budget_ms
+    print(f"budget {args.budget_ms} ms for import + create_app: {'EXCEEDED' if over else 'ok'}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"database": db_path, "path": args.path, "budget_ms": args.budget_ms, "results": results}, f, indent=2)
+    return 1 if over else 0
+
+
+def compare(before_path, after_path):
+    """ print a side by side view of two saved runs """
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    after_levels = {lvl["concurrency"]: lvl for lvl in after["levels"]}
+    print(f"{'c':>4} {'metric':<20} {'before':>10} {'after':>10} {'change':>8}")
+    for lvl in before["levels"]:
+        other = after_levels.get(lvl["concurrency"])
+        if not other:
+            continue
+        for metric in ["throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request"]:
+            a, b = lvl["overall"][metric], other["overall"][metric]
+            change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ""
+            print(f"{lvl['concurrency']:>4} {metric:<20} {a!s:>10} {b!s:>10} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ReptileDB API benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="seed, start the server and measure")
+    p.add_argument("--db", help="SQLite file to use (seeded if missing)")
+    p.add_argument("--reseed", action="store_true", help="rebuild the database even if it exists")
+    p.add_argument("--reptiles", type=int, default=1000)
+    p.add_argument("--children", type=int, default=5, help="mean number of child rows per list")
+    p.add_argument("--concurrency", default="1,4,16")
+    p.add_argument("--requests", type=int, default=1000, help="requests per concurrency level")
+    p.add_argument("--warmup", type=int, default=100)
+    p.add_argument("--threads", type=int, default=8, help="waitress threads")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5055)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--label", default="")
+    p.add_argument("--output", help="write JSON results here")
+
+    p = sub.add_parser("seed", help="only build the synthetic database")
+    p.add_argument("--db", required=True)
+    p.add_argument("--reptiles", type=int, default=1000)
+    p.add_argument("--children", type=int, default=5)
+    p.add_argument("--seed", type=int, default=42)
+
+    p = sub.add_parser("serve", help="run the API with query counting (used by run)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5055)
+    p.add_argument("--threads", type=int, default=8)
+
+    p = sub.add_parser("plans", help="per-endpoint query plans before and after a migration step")
+    p.add_argument("--db", help="SQLite file to use (seeded if missing)")
+    p.add_argument("--step", type=int, default=2, help="migration step to compare")
+    p.add_argument("--reptiles", type=int, default=1000)
+    p.add_argument("--children", type=int, default=5)
+    p.add_argument("--repeat", type=int, default=20, help="timed requests per endpoint")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--output", help="write JSON plans here")
+
+    p = sub.add_parser("startup", help="measure import and startup time against a budget")
+    p.add_argument("--db", help="SQLite file to use (seeded if missing)")
+    p.add_argument("--reptiles", type=int, default=1000)
+    p.add_argument("--children", type=int, default=5)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--repeat", type=int, default=5, help="fresh processes per mode")
+    p.add_argument("--path", default="/reptiles/autocomplete?prefix=a", help="first request to time")
+    p.add_argument("--budget-ms", type=float, default=1500.0)
+    p.add_argument("--output", help="write JSON results here")
+
+    p = sub.add_parser("compare", help="compare two JSON result files")
+    p.add_argument("before")
+    p.add_argument("after")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+    elif args.command == "seed":
+        seed_database(args.db, args.reptiles, args.children, args.seed)
+    elif args.command == "serve":
+        serve(args.host, args.port, args.threads)
+    elif args.command == "plans":
+        plans(args)
+    elif args.command == "startup":
+        sys.exit(startup(args))
+    elif args.command == "compare":
+        compare(args.before, args.after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Bibliography lookups that do not load the reptile graph.
+
+All listings use keyset pagination: the client passes the last key it saw
+as ``after`` and gets the next ``limit`` rows in key order, so every page
+is an index range scan regardless of how deep the client has paged.
+Free-text search uses the MySQL FULLTEXT indexes on bib_title/bib_authors
+and falls back to LIKE on other databases.
+"""
+from sqlalchemy import select, func, or_, text
+
+from models import Reptile, Biblio, reptile_biblio
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def page_limit(value):
+    """ parse a limit argument, raises ValueError """
+    limit = DEFAULT_LIMIT if value is None else int(value)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def serialize_bib(bib):
+    return {
+        "bib_id": bib.bib_id,
+        "bib_authors": bib.bib_authors,
+        "bib_year": bib.bib_year,
+        "bib_title": bib.bib_title,
+        "bib_journal": bib.bib_journal,
+        "bib_url": bib.bib_url,
+    }
+
+
+def get_bib(session, bib_id):
+    """ one reference plus the number of species citing it, or None """
+    bib = session.get(Biblio, bib_id)
+    if bib is None:
+        return None
+    count = session.execute(
+        select(func.count()).select_from(reptile_biblio).where(reptile_biblio.c.biblio_id == bib_id)
+    ).scalar()
+    return dict(serialize_bib(bib), reptile_count=count)
+
+
+def bib_reptiles(session, bib_id, after=None, limit=DEFAULT_LIMIT):
+    """ one page of species citing bib_id, keyed on reptile id """
+    query = (
+        select(Reptile.id, Reptile.subspecies_1, Reptile.subspecies_2,
+               Reptile.subspecies_finder, Reptile.subspecies_year)
+        .join(reptile_biblio, reptile_biblio.c.reptile_id == Reptile.id)
+        .where(reptile_biblio.c.biblio_id == bib_id)
+        .order_by(Reptile.id)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(Reptile.id > after)
+    items = [dict(row._mapping) for row in session.execute(query)]
+    return {"items": items, "next": items[-1]["id"] if len(items) == limit else None}
+
+
+def _fulltext(session, columns, terms, param):
+    if session.get_bind().dialect.name == "mysql":
+        cols = ", ".join(c.name for c in columns)
+        return text(f"MATCH ({cols}) AGAINST (:{param} IN BOOLEAN MODE)").bindparams(**{param: terms})
+    return or_(*[c.ilike(f"%{terms}%") for c in columns])
+
+
+def search_bibs(session, q=None, author=None, year=None, after=None, limit=DEFAULT_LIMIT):
+    """ one page of references matching the filters, keyed on bib_id """
+    query = select(Biblio).order_by(Biblio.bib_id).limit(limit)
+    if year:
+        query = query.where(Biblio.bib_year == str(year))
+    if author:
+        query = query.where(_fulltext(session, [Biblio.bib_authors], author, "ft_author"))
+    if q:
+        query = query.where(_fulltext(session, [Biblio.bib_title, Biblio.bib_authors], q, "ft_query"))
+    if after is not None:
+        query = query.where(Biblio.bib_id > after)
+    bibs = session.execute(query).scalars().all()
+    return {"items": [serialize_bib(b) for b in bibs], "next": bibs[-1].bib_id if len(bibs) == limit else None}
@@ -0,0 +1,199 @@
+"""
+Structured, batched creation of reptiles.
+
+Items are plain JSON objects with the same field names the API returns
+(lists stay lists).  Everything is validated before the first write; taxa
+and bibliography ids are resolved with one IN query each and kept in
+memory.  Reptiles, each child table and the bibliography links are then
+written with one executemany INSERT per table, and the new reptile ids are
+read back through the (subspecies_1, subspecies_2) unique key.  The caller
+owns the transaction.
+"""
+from sqlalchemy import insert, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import Reptile, Synonym, Comment, Common_Name, Distribution, Diagnosis, External_Link, \
+    Specimen, Etymology, Taxa, Biblio, reptile_biblio
+from regions import link_reptiles
+from resolve import index_reptiles
+from dedupe import child_values
+
+# request field -> (relationship attribute, child model)
+CHILD_LISTS = {
+    "synonyms": ("synonyms", Synonym),
+    "common_names": ("common_names", Common_Name),
+    "distributions": ("distributions", Distribution),
+    "comments": ("comments", Comment),
+    "diagnoses": ("diagnoses", Diagnosis),
+    "external_links": ("external_links", External_Link),
+    "specimens": ("specimens", Specimen),
+    "etymologies": ("etymologies", Etymology),
+}
+REPTILE_COLUMNS = ("subspecies_1", "subspecies_2", "subspecies_finder", "subspecies_year",
+                   "col05", "col16", "col17", "reproduction")
+REQUIRED = ("taxa", "subspecies_1", "subspecies_2", "subspecies_year")
+STRING_FIELDS = ("taxa", "subspecies_1", "subspecies_2", "subspecies_finder", "col05", "col16", "col17", "reproduction")
+
+MAX_ITEMS = 5000
+IN_CHUNK = 500
+
+
+def validate_item(item):
+    """ list of problems with one submitted reptile (empty when valid) """
+    if not isinstance(item, dict):
+        return ["item must be an object"]
+    errors = []
+    for field in REQUIRED:
+        if item.get(field) in (None, ""):
+            errors.append(f"{field} is required")
+    for field in STRING_FIELDS:
+        if item.get(field) is not None and not isinstance(item[field], str):
+            errors.append(f"{field} must be a string")
+    year = item.get("subspecies_year")
+    if year not in (None, ""):
+        try:
+            int(year)
+        except (TypeError, ValueError):
+            errors.append("subspecies_year must be an integer")
+    for field in list(CHILD_LISTS) + ["bibliography_ids"]:
+        values = item.get(field, [])
+        if not isinstance(values, list) or not all(isinstance(v, (str, int)) for v in values):
+            errors.append(f"{field} must be a list of strings")
+    return errors
+
+
+def reptile_row(item):
+    """ the 19-column row layout Reptile() expects """
+    row = [None] * 19
+    row[0] = item["taxa"].strip()
+    row[1] = item["subspecies_1"].strip()
+    row[2] = item["subspecies_2"].strip()
+    row[3] = item.get("subspecies_finder") or ""
+    row[4] = int(item["subspecies_year"])
+    row[5] = item.get("col05") or ""
+    row[16] = item.get("col16") or ""
+    row[17] = item.get("col17") or ""
+    row[18] = item.get("reproduction") or ""
+    return row
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), IN_CHUNK):
+        yield values[i:i + IN_CHUNK]
+
+
+def clean_list(values):
+    """ stripped, non-empty, de-duplicated values in submission order """
+    seen, out = set(), []
+    for value in values:
+        value = str(value).strip()
+        if value and value not in seen:
+            seen.add(value)
+            out.append(value)
+    return out
+
+
+def _key_ids(session, keys):
+    """ {(subspecies_1, subspecies_2): reptile id} for the keys that exist """
+    found = {}
+    for chunk in _chunks(keys):
+        for rid, s1, s2 in session.query(Reptile.id, Reptile.subspecies_1, Reptile.subspecies_2).filter(
+            tuple_(Reptile.subspecies_1, Reptile.subspecies_2).in_(chunk)
+        ):
+            found[(s1, s2)] = rid
+    return found
+
+
+def bulk_add(session, items, atomic=False):
+    """
+    create reptiles for items, returns (created reptiles, per-item results)
+
+    Invalid or duplicate items are reported and skipped; with atomic=True
+    any failure means nothing is written.
+    """
+    results = [{"index": i} for i in range(len(items))]
+    valid = []
+    for i, item in enumerate(items):
+        errors = validate_item(item)
+        if errors:
+            results[i].update(status="invalid", errors=errors)
+        else:
+            valid.append(i)
+
+    # duplicates within the batch and against the database
+    keys = {}
+    for i in list(valid):
+        key = (items[i]["subspecies_1"].strip(), items[i]["subspecies_2"].strip())
+        if key in keys:
+            results[i].update(status="duplicate", errors=[f"same species as item {keys[key]}"])
+            valid.remove(i)
+        else:
+            keys[key] = i
+    existing = _key_ids(session, keys)
+    for key, i in list(keys.items()):
+        if key in existing:
+            results[i].update(status="duplicate", errors=[f"species already exists as reptile {existing[key]}"])
+            valid.remove(i)
+            del keys[key]
+
+    if atomic and len(valid) != len(items):
+        for i in valid:
+            results[i].update(status="skipped", errors=["batch rejected because other items failed"])
+        return [], results
+
+    # resolve lookups once for the whole batch
+    taxa_values = {items[i]["taxa"].strip() for i in valid}
+    taxa_map = {}
+    for chunk in _chunks(taxa_values):
+        taxa_map.update((t.value, t) for t in session.query(Taxa).filter(Taxa.value.in_(chunk)))
+    for value in taxa_values - set(taxa_map):
+        taxa_map[value] = Taxa([value])
+        session.add(taxa_map[value])
+
+    bib_ids = {str(b).strip() for i in valid for b in items[i].get("bibliography_ids", [])}
+    bib_map = {}
+    for chunk in _chunks(bib_ids):
+        bib_map.update((b.bib_id, b) for b in session.query(Biblio).filter(Biblio.bib_id.in_(chunk)))
+
+    if not valid:
+        return [], results
+    session.flush()
+
+    rows = []
+    for i in valid:
+        # the model constructor applies the same conversions as the loader
+        reptile = Reptile(reptile_row(items[i]))
+        row = {column: getattr(reptile, column) for column in REPTILE_COLUMNS}
+        row["taxa_id"] = taxa_map[items[i]["taxa"].strip()].id
+        rows.append(row)
+    session.execute(insert(Reptile), rows)
+    ids = _key_ids(session, keys)
+
+    child_rows = {field: [] for field in CHILD_LISTS}
+    link_rows = []
+    for i in valid:
+        item = items[i]
+        rid = ids[(item["subspecies_1"].strip(), item["subspecies_2"].strip())]
+        for field, (_, model) in CHILD_LISTS.items():
+            child_rows[field].extend({"reptile_id": rid, "value": value}
+                                     for value in child_values(model, clean_list(item.get(field, []))))
+        wanted = clean_list(item.get("bibliography_ids", []))
+        link_rows.extend({"reptile_id": rid, "biblio_id": b} for b in wanted if b in bib_map)
+        missing = [b for b in wanted if b not in bib_map]
+        if missing:
+            results[i]["warnings"] = [f"unknown bibliography ids: {', '.join(missing)}"]
+        results[i].update(status="created", id=rid)
+
+    for field, (_, model) in CHILD_LISTS.items():
+        if child_rows[field]:
+            session.execute(insert(model), child_rows[field])
+    if link_rows:
+        session.execute(reptile_biblio.insert(), link_rows)
+    link_reptiles(session, ids.values())
+    index_reptiles(session, ids.values())
+
+    created = session.query(Reptile).options(
+        joinedload(Reptile.taxa), selectinload(Reptile.regions)
+    ).filter(Reptile.id.in_(list(ids.values()))).all()
+    return created, results
@@ -0,0 +1,168 @@
+"""
+Change log for cross-process cache invalidation.
+
+Every write appends (reptile_id, op, version) rows to reptile_changes in
+the same transaction as the write itself; ``version`` counts the changes
+of one reptile.  A full reload by the loader is a single "reload" row with
+no reptile id.  Each worker keeps the highest change id it has seen and,
+at most once per poll interval, reads the rows above it (a primary key
+range scan) and hands them to its subscribers, which drop or refresh only
+the affected cache entries.
+
+Ids are assigned at insert but become visible at commit, so a slow
+transaction can show up below ids a worker has already passed.  Holes in
+the id sequence are therefore re-checked for GAP_TIMEOUT seconds (after
+that they are taken to be rolled back).
+
+Usage (from the api directory):
+
+    python changes.py prune --days 7
+"""
+import sys
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+from sqlalchemy import select, func, insert, delete
+
+from models import ReptileChange
+
+CREATE, UPDATE, DELETE, RELOAD = "create", "update", "delete", "reload"
+POLL_LIMIT = 1000
+GAP_TIMEOUT = 60.0
+MAX_GAPS = 10000
+IN_CHUNK = 500
+
+
+def record_changes(session, reptile_ids, op):
+    """ append one change row per reptile; the caller commits it together with the write """
+    reptile_ids = list(dict.fromkeys(reptile_ids))
+    versions = {}
+    for i in range(0, len(reptile_ids), IN_CHUNK):
+        versions.update(session.execute(
+            select(ReptileChange.reptile_id, func.max(ReptileChange.version))
+            .where(ReptileChange.reptile_id.in_(reptile_ids[i:i + IN_CHUNK]))
+            .group_by(ReptileChange.reptile_id)
+        ).all())
+    now = datetime.now(timezone.utc)
+    rows = [{"reptile_id": rid, "op": op, "version": versions.get(rid, 0) + 1, "changed_at": now}
+            for rid in reptile_ids]
+    if rows:
+        session.execute(insert(ReptileChange), rows)
+
+
+def record_reload(session):
+    """ mark everything as changed, e.g. after the loader replaced the tables """
+    session.execute(insert(ReptileChange), [{"reptile_id": None, "op": RELOAD, "version": 1,
+                                             "changed_at": datetime.now(timezone.utc)}])
+
+
+def prune_changes(session, older_than):
+    """ delete change rows older than the given timedelta; the newest row is always kept """
+    newest = session.execute(select(func.max(ReptileChange.id))).scalar()
+    if newest is None:
+        return 0
+    cutoff = datetime.now(timezone.utc) - older_than
+    result = session.execute(delete(ReptileChange).where(ReptileChange.changed_at < cutoff,
+                                                         ReptileChange.id < newest))
+    return result.rowcount
+
+
+class ChangeFollower:
+    """ per-process reader of the change log """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.last_id = None
+        self._gaps = {}     # missing change id -> monotonic time it was first missed
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """ callback(session, changes) with changes a list of (reptile_id, op), oldest first """
+        self._subscribers.append(callback)
+
+    def start(self, session):
+        """ skip the existing log; caches built from now on already reflect it """
+        if self.last_id is None:
+            self.last_id = session.execute(select(func.max(ReptileChange.id))).scalar() or 0
+
+    def due(self):
+        """ True once the poll interval has passed """
+        return time.monotonic() - self._last_poll >= self.interval
+
+    def poll(self, session, force=False):
+        """ apply new changes if the interval has passed, returns how many were seen """
+        now = time.monotonic()
+        if not force and not self.due():
+            return 0
+        if not self._lock.acquire(blocking=False):
+            return 0    # another thread of this worker is already polling
+        try:
+            self._last_poll = now
+            if self.last_id is None:
+                self.start(session)
+                return 0
+            seen = self._apply(session, self._late_rows(session, now))
+            while True:
+                rows = session.execute(
+                    select(ReptileChange.id, ReptileChange.reptile_id, ReptileChange.op)
+                    .where(ReptileChange.id > self.last_id).order_by(ReptileChange.id).limit(POLL_LIMIT)
+                ).all()
+                if not rows:
+                    return seen
+                expected = self.last_id + 1
+                for row_id, _, _ in rows:
+                    for missing in range(expected, min(row_id, expected + MAX_GAPS - len(self._gaps))):
+                        self._gaps.setdefault(missing, now)
+                    expected = row_id + 1
+                self.last_id = rows[-1][0]
+                seen += self._apply(session, rows)
+        finally:
+            self._lock.release()
+
+    def _late_rows(self, session, now):
+        """ rows that have since appeared in earlier holes of the id sequence """
+        for gap, first_missed in list(self._gaps.items()):
+            if now - first_missed > GAP_TIMEOUT:
+                del self._gaps[gap]
+        if not self._gaps:
+            return []
+        rows = session.execute(
+            select(ReptileChange.id, ReptileChange.reptile_id, ReptileChange.op)
+            .where(ReptileChange.id.in_(list(self._gaps))).order_by(ReptileChange.id)
+        ).all()
+        for row_id, _, _ in rows:
+            del self._gaps[row_id]
+        return rows
+
+    def _apply(self, session, rows):
+        if not rows:
+            return 0
+        changes = [(rid, op) for _, rid, op in rows]
+        for callback in self._subscribers:
+            try:
+                callback(session, changes)
+            except Exception:
+                logger.exception("change log subscriber failed")
+        return len(rows)
+
+
+change_follower = ChangeFollower()
+
+
+if __name__ == "__main__":
+    from database import get_db_session
+
+    if len(sys.argv) != 4 or sys.argv[1] != "prune" or sys.argv[2] != "--days":
+        print("usage: python changes.py prune --days N")
+        sys.exit(1)
+    session = get_db_session()
+    try:
+        removed = prune_changes(session, timedelta(days=float(sys.argv[3])))
+        session.commit()
+    finally:
+        session.close()
+    print(f"{removed} change rows removed")
@@ -0,0 +1,233 @@
+"""
+Opt-in compression of large text columns.
+
+Columns listed in REPTILEDB_COMPRESSED_COLUMNS (comma separated, e.g.
+"diagnoses.value,comments.value") are declared in models.py with the
+CompressedText type.  Values are stored as one marker byte plus payload:
+
+    0x00  utf-8 text, stored as-is (short or incompressible values)
+    0x01  zlib
+    0x02  zstd (needs the optional zstandard package)
+
+Compressed bytes are what travels from the database; decompression
+happens in the API process when rows are loaded.  Values without a marker
+byte are plain text from before the conversion and are read unchanged.
+
+Decoding is not deferred to serialization: every code path that loads
+these values needs the text anyway (serialize_reptile, the diff in
+update.py, the value_hash in dedupe.py, the export), and a lazy wrapper
+would leak into all of them.  What a deferred decode could save is the
+decode of values that are loaded and never read, which no endpoint does;
+`python compression.py report` shows the decode time per column
+(6 to 14 us a value on the benchmark data).
+
+Only columns that are never searched in SQL can be compressed.
+specimens.value (types filter) and bibliography.bib_title (references
+filter and the FULLTEXT index) have to stay plain text.
+
+The setting is read from the environment when models.py is imported, so
+it must be the same for every process.  After enabling a column, convert
+the stored rows (the report shows bytes saved, and the time to fetch and to
+decode the whole column, before and after):
+
+    python compression.py report
+    python compression.py convert
+    python compression.py revert     # back to plain text, before disabling
+"""
+import os
+import sys
+import time
+import zlib
+
+from dotenv import load_dotenv
+from sqlalchemy import LargeBinary, String, Text, bindparam, update
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# models.py may be imported before database.py has read the .env file
+load_dotenv()
+
+RAW, ZLIB, ZSTD = b"\x00", b"\x01", b"\x02"
+
+# columns that may be compressed -> their plain text type
+COMPRESSIBLE = {
+    "diagnoses.value": Text(65336),
+    "comments.value": String(8192),
+}
+SEARCHED = ("specimens.value", "bibliography.bib_title")
+
+MIN_SIZE = 256
+CHUNK = 500
+
+
+def _enabled():
+    names = {n.strip() for n in os.getenv("REPTILEDB_COMPRESSED_COLUMNS", "").split(",") if n.strip()}
+    for name in names - set(COMPRESSIBLE):
+        reason = "it is searched in SQL" if name in SEARCHED else "it is not a compressible column"
+        raise ValueError(f"REPTILEDB_COMPRESSED_COLUMNS: cannot compress {name}, {reason}")
+    return names
+
+
+ENABLED = _enabled()
+CODEC = os.getenv("REPTILEDB_COMPRESSION", "zlib")
+if CODEC not in ("zlib", "zstd") or (CODEC == "zstd" and zstandard is None):
+    raise ValueError(f"REPTILEDB_COMPRESSION: unsupported codec {CODEC!r} (zlib, or zstd with zstandard installed)")
+
+
+def compress_text(text, codec=None):
+    """ marker byte + payload for text """
+    if text is None:
+        return None
+    data = text.encode("utf-8")
+    if len(data) >= MIN_SIZE:
+        if (codec or CODEC) == "zstd":
+            packed = ZSTD + zstandard.ZstdCompressor(level=9).compress(data)
+        else:
+            packed = ZLIB + zlib.compress(data, 9)
+        if len(packed) < len(data):
+            return packed
+    return RAW + data
+
+
+def decompress_text(value):
+    """ text from a stored value, with or without a marker byte """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    marker, payload = value[:1], value[1:]
+    if marker == RAW:
+        return payload.decode("utf-8")
+    if marker == ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    if marker == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed value found but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    # written before the column was converted
+    return value.decode("utf-8")
+
+
+class CompressedText(TypeDecorator):
+    """ text stored compressed in a binary column """
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            from sqlalchemy.dialects.mysql import MEDIUMBLOB
+            return dialect.type_descriptor(MEDIUMBLOB())
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+
+def text_column(name, plain_type):
+    """ the column type for name: CompressedText when enabled, else plain_type """
+    return CompressedText() if name in ENABLED else plain_type
+
+
+def _column(name):
+    from models import Base
+    table, column = name.split(".")
+    return Base.metadata.tables[table], column
+
+
+def column_stats(conn, name):
+    """ rows, stored bytes, and the time to fetch and to decode the whole column """
+    table, column = _column(name)
+    started = time.perf_counter()
+    values = [value for (value,) in conn.exec_driver_sql(f"SELECT {column} FROM {table.name}")]
+    fetched = time.perf_counter()
+    for value in values:
+        decompress_text(value)
+    decoded = time.perf_counter()
+    stored = sum(len(v.encode("utf-8")) if isinstance(v, str) else len(v) for v in values if v is not None)
+    return {"rows": len(values), "bytes": stored, "fetch_ms": round((fetched - started) * 1000, 1),
+            "decode_ms": round((decoded - fetched) * 1000, 1)}
+
+
+def _set_column_type(conn, name, compressed):
+    if conn.dialect.name != "mysql":
+        return    # SQLite stores either kind in any column
+    table, column = _column(name)
+    kind = "MEDIUMBLOB" if compressed else COMPRESSIBLE[name].compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f"ALTER TABLE {table.name} MODIFY {column} {kind}")
+
+
+def rewrite_column(conn, name, compressed):
+    """ rewrite every value of name compressed (or back to plain text), returns rows rewritten """
+    table, column = _column(name)
+    if compressed:
+        _set_column_type(conn, name, True)
+    stmt = update(table).where(table.c.id == bindparam("row_id")).values(
+        {column: bindparam("packed", type_=LargeBinary() if compressed else COMPRESSIBLE[name])})
+    last, done = 0, 0
+    while True:
+        rows = conn.exec_driver_sql(
+            f"SELECT id, {column} FROM {table.name} WHERE id > {int(last)} ORDER BY id LIMIT {CHUNK}").all()
+        if not rows:
+            break
+        params = []
+        for row_id, value in rows:
+            text = decompress_text(value)
+            params.append({"row_id": row_id, "packed": compress_text(text) if compressed else text})
+        conn.execute(stmt, params)
+        done += len(rows)
+        last = rows[-1][0]
+    if not compressed:
+        _set_column_type(conn, name, False)
+    return done
+
+
+def convert(engine, names, compressed=True):
+    """ convert columns, returns {name: {"before": stats, "after": stats}} """
+    report = {}
+    for name in names:
+        with engine.connect() as conn:
+            before = column_stats(conn, name)
+        with engine.begin() as conn:
+            rewrite_column(conn, name, compressed)
+        with engine.connect() as conn:
+            after = column_stats(conn, name)
+        report[name] = {"before": before, "after": after}
+    return report
+
+
+def print_report(report):
+    print(f"{'column':<18} {'rows':>8} {'bytes before':>13} {'bytes after':>12} {'saved':>7} "
+          f"{'fetch ms':>16} {'decode ms':>16}")
+    for name, r in report.items():
+        b, a = r["before"], r["after"]
+        saved = f"{(1 - a['bytes'] / b['bytes']) * 100:.1f}%" if b["bytes"] else "-"
+        print(f"{name:<18} {b['rows']:>8} {b['bytes']:>13} {a['bytes']:>12} {saved:>7} "
+              f"{b['fetch_ms']:>7} -> {a['fetch_ms']:<6} {b['decode_ms']:>7} -> {a['decode_ms']:<6}")
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if command == "convert":
+        print_report(convert(engine, sorted(ENABLED), compressed=True))
+    elif command == "revert":
+        print_report(convert(engine, sorted(ENABLED), compressed=False))
+    elif command == "report":
+        with engine.connect() as conn:
+            for name in sorted(COMPRESSIBLE):
+                stats = column_stats(conn, name)
+                state = "compressed" if name in ENABLED else "plain"
+                print(f"{name:<18} {state:<10} {stats['rows']:>8} rows {stats['bytes']:>12} bytes "
+                      f"{stats['fetch_ms']:>8} ms fetch {stats['decode_ms']:>8} ms decode")
+    else:
+        print("usage: python compression.py [report|convert|revert]")
+        sys.exit(1)
@@ -1,55 +1,141 @@
 import os
 import sys
-import pymysql
+import sqlite3
+import threading
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Retrieve the database connection details from environment variables
-db_user = os.getenv('REPTILEDB_USER')
-db_password = os.getenv('REPTILEDB_PASSWORD')
-db_host = os.getenv('REPTILEDB_HOST')
-db_port = os.getenv('REPTILEDB_PORT')
-db_name = os.getenv('REPTILEDB_NAME')
-db_sqlite = os.getenv('REPTILEDB_SQLITE')
+# connection settings, read from the environment unless configure() overrides them
+SETTINGS = ('REPTILEDB_USE_DB', 'REPTILEDB_USER', 'REPTILEDB_PASSWORD', 'REPTILEDB_HOST', 'REPTILEDB_PORT',
+            'REPTILEDB_NAME', 'REPTILEDB_SQLITE', 'REPTILEDB_SNAPSHOT', 'REPTILEDB_MMAP_SIZE')
 
-db_use_db = os.getenv('REPTILEDB_USE_DB')
 
-# Construct the database URL
+class DatabaseNotConfigured(RuntimeError):
+    pass
 
 
-if db_use_db=="MYSQL":
-    db_url = f'mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
-    engine = create_engine(db_url, connect_args={"connect_timeout": 10})
-    db_using_name = f'mysql+pymysql://{db_user}@{db_host}:{db_port}/{db_name}'
-elif db_use_db=="SQLITE":
-    db_url = f"sqlite:///{db_sqlite}"
-    engine = create_engine(db_url)
-    db_using_name = db_url
-else:
-    print(f"No database option selected.\nSet REPTILEDB_USE_DB to MYSQL or SQLITE in .ENV file.")
-    sys.exit( 1 )
-    
+class DatabaseInUse(RuntimeError):
+    pass
 
 
-# Create a SQLAlchemy engine
+_overrides = {}
+_engine = None
+_claimed = False
+_lock = threading.Lock()
+db_using_name = None
+
+# Create a configured "Session" class; it is bound to the engine per session
+Session = sessionmaker()
+
+
+def setting(name, default=None):
+    value = _overrides.get(name)
+    return value if value is not None else os.getenv(name, default)
+
+
+def _effective(overrides):
+    return {name: overrides[name] if overrides.get(name) is not None else os.getenv(name) for name in SETTINGS}
+
+
+def configure(config=None, claim=False):
+    """
+    take REPTILEDB_* settings from config instead of the environment
+
+    The current engine is dropped when the settings change.  With claim the
+    settings are fixed for the rest of the process: the engine, the change
+    follower, the job runner and the in-memory indexes are shared by every
+    app in it, so a later configure() to another database raises
+    DatabaseInUse instead of moving those apps along.
+    """
+    global _engine, _claimed
+    overrides = {k: v for k, v in (config or {}).items() if k in SETTINGS and v is not None}
+    with _lock:
+        changed = _effective(overrides) != _effective(_overrides)
+        if changed and _claimed:
+            raise DatabaseInUse("the database of this process is already used by an app; "
+                                "run apps for other databases in their own processes")
+        _claimed = _claimed or claim
+        if not changed:
+            return
+        _overrides.clear()
+        _overrides.update(overrides)
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def snapshot_connector(path, mmap_size):
+    def connect():
+        """ read-only, immutable, memory-mapped connection to a snapshot built by snapshot.py """
+        conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+    return connect
+
+
+def _build_engine():
+    """ (engine, printable name) for the configured database """
+    db_use_db = setting('REPTILEDB_USE_DB')
+
+    # Construct the database URL
+    if db_use_db=="MYSQL":
+        db_user, db_host = setting('REPTILEDB_USER'), setting('REPTILEDB_HOST')
+        db_port, db_name = setting('REPTILEDB_PORT'), setting('REPTILEDB_NAME')
+        db_url = f'mysql+pymysql://{db_user}:{setting("REPTILEDB_PASSWORD")}@{db_host}:{db_port}/{db_name}'
+        engine = create_engine(db_url, connect_args={"connect_timeout": 10})
+        return engine, f'mysql+pymysql://{db_user}@{db_host}:{db_port}/{db_name}'
+    elif db_use_db=="SQLITE":
+        db_url = f"sqlite:///{setting('REPTILEDB_SQLITE')}"
+        return create_engine(db_url), db_url
+    elif db_use_db=="SNAPSHOT":
+        db_snapshot = setting('REPTILEDB_SNAPSHOT', setting('REPTILEDB_SQLITE'))
+        connect = snapshot_connector(db_snapshot, setting('REPTILEDB_MMAP_SIZE', 256 * 1024 * 1024))
+        # the creator bypasses the URL, so ask for a real pool instead of the in-memory default
+        engine = create_engine("sqlite://", creator=connect, poolclass=QueuePool)
+        return engine, f"sqlite snapshot {db_snapshot} (read-only)"
+    raise DatabaseNotConfigured(
+        "No database option selected.\nSet REPTILEDB_USE_DB to MYSQL, SQLITE or SNAPSHOT in .ENV file.")
+
+
+def get_engine():
+    """ the shared engine, created on first use """
+    global _engine, db_using_name
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine, db_using_name = _build_engine()
+    return _engine
 
-# Create a configured "Session" class
-Session = sessionmaker(bind=engine)
 
 def get_db_session():
     """Return a new session."""
-    return Session()
+    return Session(bind=get_engine())
+
+
+def __getattr__(name):
+    # `from database import engine` still works, but only connects when asked for
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
+    import pymysql
+
     # Test the connection
     try:
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
             print(f"Database connection successful! Using {db_using_name}")
+    except DatabaseNotConfigured as e:
+        print(e)
+        sys.exit( 1 )
     except OperationalError as e:
         if isinstance(e.orig, pymysql.err.OperationalError):
             if e.orig.args[0] in (2003, 2006):
@@ -0,0 +1,94 @@
+"""
+Duplicate child values.
+
+The original loader stored repeated synonyms, names, links and so on for
+many reptiles.  Every child table now carries value_hash (sha1 of value)
+and a unique (reptile_id, value_hash) index, so a value can only be stored
+once per reptile.  New rows are de-duplicated before they are written
+(child_values); the cleanup below fills value_hash for existing rows and
+deletes the repeats, keeping the oldest row of each group.  It runs as
+migration 6 and can be re-run on its own to report what it removes.
+
+Usage (from the api directory):
+
+    python dedupe.py
+"""
+from sqlalchemy import select, update, delete, bindparam
+
+from models import Synonym, Column7, Comment, Common_Name, Distribution, Diagnosis, External_Link, \
+    Specimen, Etymology, value_hash
+
+CHILD_MODELS = (Synonym, Column7, Comment, Common_Name, Distribution, Diagnosis, External_Link,
+                Specimen, Etymology)
+CHUNK = 1000
+
+
+def child_values(model, values):
+    """ values as model stores them (cleaned, truncated), each once, in order """
+    return list(dict.fromkeys(model(value).value for value in values))
+
+
+def _chunks(values):
+    for i in range(0, len(values), CHUNK):
+        yield values[i:i + CHUNK]
+
+
+def fill_hashes(session, model):
+    """ set value_hash on rows that do not have one yet, returns the number of rows updated """
+    table = model.__table__
+    stmt = update(table).where(table.c.id == bindparam("row_id")).values(value_hash=bindparam("row_hash"))
+    filled, last = 0, None
+    while True:
+        query = select(table.c.id, table.c.value).where(table.c.value_hash.is_(None)).order_by(table.c.id).limit(CHUNK)
+        if last is not None:
+            query = query.where(table.c.id > last)
+        rows = session.execute(query).all()
+        if not rows:
+            return filled
+        # rows with a NULL value keep a NULL hash and are skipped by the keyset
+        params = [{"row_id": row_id, "row_hash": value_hash(value)} for row_id, value in rows if value is not None]
+        if params:
+            session.execute(stmt, params)
+        filled += len(params)
+        last = rows[-1][0]
+
+
+def remove_duplicates(session, model):
+    """ delete all but the oldest row per (reptile_id, value_hash), returns the number deleted """
+    table = model.__table__
+    previous, doomed = None, []
+    for row_id, reptile_id, hashed in session.execute(
+        select(table.c.id, table.c.reptile_id, table.c.value_hash)
+        .where(table.c.reptile_id.is_not(None), table.c.value_hash.is_not(None))
+        .order_by(table.c.reptile_id, table.c.value_hash, table.c.id)
+    ):
+        # sorted, so repeats of a group follow its oldest row
+        if (reptile_id, hashed) == previous:
+            doomed.append(row_id)
+        previous = (reptile_id, hashed)
+    for chunk in _chunks(doomed):
+        session.execute(delete(table).where(table.c.id.in_(chunk)))
+    return len(doomed)
+
+
+def dedupe_children(session):
+    """ fill hashes and drop duplicates in every child table, returns {table: rows deleted} """
+    report = {}
+    for model in CHILD_MODELS:
+        fill_hashes(session, model)
+        report[model.__tablename__] = remove_duplicates(session, model)
+    session.flush()
+    return report
+
+
+if __name__ == "__main__":
+    from database import get_db_session
+
+    session = get_db_session()
+    try:
+        report = dedupe_children(session)
+        session.commit()
+    finally:
+        session.close()
+    for table, removed in report.items():
+        print(f"{table:16} {removed:8} duplicates removed")
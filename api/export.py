@@ -0,0 +1,190 @@
+"""
+Streaming export of the whole database.
+
+Reptiles are read in id ranges (keyset, ``chunk`` ids at a time).  For each
+range the child tables and bibliography are loaded with one range query
+each and stitched together in memory, so memory use depends on the chunk
+size and not on the size of the database.  Output is either NDJSON (one
+reptile with children per line) or one CSV file per table, optionally
+gzip-compressed as it streams.
+
+Usage (from the api directory):
+
+    python export.py --format ndjson --gzip --output reptiles.ndjson.gz
+    python export.py --format csv --output export_dir
+"""
+import io
+import os
+import csv
+import sys
+import json
+import zlib
+import argparse
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from models import Reptile, Taxa, Biblio, reptile_biblio, Synonym, Comment, Common_Name, Distribution, \
+    Diagnosis, External_Link, Specimen, Etymology
+
+DEFAULT_CHUNK = 500
+
+# NDJSON key -> child model, in serialize_reptile order
+CHILDREN = OrderedDict([
+    ("synonyms", Synonym),
+    ("comments", Comment),
+    ("common_names", Common_Name),
+    ("distributions", Distribution),
+    ("diagnoses", Diagnosis),
+    ("external_links", External_Link),
+    ("etymologies", Etymology),
+    ("specimens", Specimen),
+])
+
+BIB_COLUMNS = ("bib_id", "bib_authors", "bib_year", "bib_title", "bib_journal", "bib_url")
+
+# CSV table name -> (table, keyset column)
+CSV_TABLES = OrderedDict(
+    [("reptiles", (Reptile.__table__, "id")), ("taxa", (Taxa.__table__, "id"))]
+    + [(model.__tablename__, (model.__table__, "id")) for model in CHILDREN.values()]
+    + [("bibliography", (Biblio.__table__, "bib_id")), ("reptile_biblio", (reptile_biblio, "reptile_id"))]
+)
+
+
+def id_ranges(session, column, chunk, distinct=False):
+    """ yield (first, last) key pairs covering column in chunks of at most chunk keys """
+    last = None
+    while True:
+        query = select(column).order_by(column).limit(chunk)
+        if distinct:
+            query = query.distinct()
+        if last is not None:
+            query = query.where(column > last)
+        keys = session.execute(query).scalars().all()
+        if not keys:
+            return
+        yield keys[0], keys[-1]
+        last = keys[-1]
+
+
+def reptile_documents(session, chunk=DEFAULT_CHUNK):
+    """ yield one dict per reptile, children and bibliography included """
+    for first, last in id_ranges(session, Reptile.id, chunk):
+        in_range = Reptile.id.between(first, last)
+        rows = session.execute(
+            select(Reptile.id, Reptile.subspecies_1, Reptile.reproduction, Reptile.subspecies_2,
+                   Reptile.subspecies_finder, Reptile.subspecies_year, Reptile.col17, Taxa.value)
+            .outerjoin(Taxa, Reptile.taxa_id == Taxa.id)
+            .where(in_range).order_by(Reptile.id)
+        ).all()
+
+        children = {key: {} for key in CHILDREN}
+        for key, model in CHILDREN.items():
+            for rid, value in session.execute(
+                select(model.reptile_id, model.value)
+                .where(model.reptile_id.between(first, last)).order_by(model.reptile_id, model.id)
+            ):
+                children[key].setdefault(rid, []).append(value)
+
+        bibs = {}
+        for row in session.execute(
+            select(reptile_biblio.c.reptile_id, *[getattr(Biblio, c) for c in BIB_COLUMNS])
+            .join(Biblio, Biblio.bib_id == reptile_biblio.c.biblio_id)
+            .where(reptile_biblio.c.reptile_id.between(first, last))
+        ):
+            bibs.setdefault(row[0], []).append(dict(zip(BIB_COLUMNS, row[1:])))
+
+        for rid, s1, reproduction, s2, finder, year, iucn, taxa in rows:
+            doc = OrderedDict([
+                ("id", rid),
+                ("subspecies_1", s1),
+                ("reproduction", reproduction),
+                ("subspecies_2", s2),
+                ("subspecies_finder", finder),
+                ("subspecies_year", year),
+                ("IUCN", iucn),
+                ("taxa", taxa),
+            ])
+            for key in CHILDREN:
+                doc[key] = children[key].get(rid, [])
+            doc["bibliography"] = bibs.get(rid, [])
+            yield doc
+
+
+def ndjson_chunks(session, chunk=DEFAULT_CHUNK):
+    """ yield NDJSON text, one block per id range """
+    buffer = []
+    for doc in reptile_documents(session, chunk):
+        buffer.append(json.dumps(doc, ensure_ascii=False, default=str))
+        if len(buffer) >= chunk:
+            yield "\n".join(buffer) + "\n"
+            buffer = []
+    if buffer:
+        yield "\n".join(buffer) + "\n"
+
+
+def csv_chunks(session, table_name, chunk=DEFAULT_CHUNK):
+    """ yield CSV text for one table, header first, one block per key range """
+    table, key = CSV_TABLES[table_name]
+    columns = list(table.columns)
+    key_column = table.c[key]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow([c.name for c in columns])
+    yield out.getvalue()
+    for first, last in id_ranges(session, key_column, chunk, distinct=table is reptile_biblio):
+        out.seek(0)
+        out.truncate()
+        rows = session.execute(select(*columns).where(key_column.between(first, last)).order_by(key_column))
+        writer.writerows(rows)
+        yield out.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """ gzip-compress a stream of text chunks on the fly """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for text in chunks:
+        data = compressor.compress(text.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode_chunks(chunks):
+    for text in chunks:
+        yield text.encode("utf-8")
+
+
+def export_files(session, fmt, output, compress=False, chunk=DEFAULT_CHUNK):
+    """ write an export to disk; csv writes one file per table into the output directory """
+    def write(path, chunks):
+        stream = gzip_chunks(chunks) if compress else encode_chunks(chunks)
+        with open(path, "wb") as f:
+            for data in stream:
+                f.write(data)
+        return path
+
+    suffix = ".gz" if compress else ""
+    if fmt == "ndjson":
+        return [write(output, ndjson_chunks(session, chunk))]
+    os.makedirs(output, exist_ok=True)
+    return [write(os.path.join(output, f"{name}.csv{suffix}"), csv_chunks(session, name, chunk))
+            for name in CSV_TABLES]
+
+
+if __name__ == "__main__":
+    from database import get_db_session
+
+    parser = argparse.ArgumentParser(description="Export the reptile database")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--output", required=True, help="file for ndjson, directory for csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK)
+    args = parser.parse_args()
+
+    session = get_db_session()
+    try:
+        for path in export_files(session, args.format, args.output, args.gzip, args.chunk):
+            print(path, file=sys.stderr)
+    finally:
+        session.close()
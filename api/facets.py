@@ -0,0 +1,111 @@
+"""
+Facet counts for the search UI: reptiles per higher taxa, per description
+year and per distribution country.
+
+Unfiltered counts are served from the facet_counts aggregate table, which
+the loader rebuilds after a load and the write endpoints adjust one reptile
+at a time.  Filtered counts run one grouped query per facet over the ids
+matched by the advanced search planner; countries are counted through
+the regions index (regions.py), so a reptile's distribution text is never
+re-parsed per request.
+"""
+from collections import Counter
+
+from sqlalchemy import select, func, insert, update, delete
+
+from models import Reptile, Taxa, FacetCount, Region, reptile_regions
+from search import matching_ids
+
+FACETS = ("taxa", "year", "country")
+
+
+def reptile_facets(reptile):
+    """ facet values a single reptile contributes to """
+    values = []
+    if reptile.taxa is not None:
+        values.append(("taxa", reptile.taxa.value))
+    if reptile.subspecies_year is not None:
+        values.append(("year", str(reptile.subspecies_year)))
+    # the linked regions, so the names match the grouped counts of rebuild_facets
+    values.extend(("country", name) for name in sorted({region.name for region in reptile.regions}))
+    return values
+
+
+def apply_reptiles(session, reptiles, delta):
+    """ add (delta=1) or remove (delta=-1) the reptiles' contribution to the aggregates """
+    changes = Counter()
+    for reptile in reptiles:
+        for facet, value in reptile_facets(reptile):
+            changes[(facet, str(value)[:255])] += delta
+    if not changes:
+        return
+    # relative updates in SQL, so concurrent writers in other workers do not lose each other's counts
+    for (facet, value), change in changes.items():
+        if not change:
+            continue
+        if change > 0:
+            # a missing row starts at 0; when another writer creates it first the insert is ignored
+            session.execute(insert(FacetCount).values(facet=facet, value=value, count=0)
+                            .prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql"))
+        session.execute(update(FacetCount).where(FacetCount.facet == facet, FacetCount.value == value)
+                        .values(count=FacetCount.count + change))
+    session.execute(delete(FacetCount).where(FacetCount.count <= 0))
+
+
+def apply_reptile(session, reptile, delta):
+    """ single-reptile form of apply_reptiles """
+    apply_reptiles(session, [reptile], delta)
+
+
+def _country_counts(session, ids=None):
+    query = select(Region.name, func.count(reptile_regions.c.reptile_id)).select_from(reptile_regions).join(
+        Region, Region.id == reptile_regions.c.region_id)
+    if ids is not None:
+        query = query.where(reptile_regions.c.reptile_id.in_(ids))
+    return Counter(dict(session.execute(query.group_by(Region.id, Region.name)).all()))
+
+
+def compute_counts(session, filters=None, countries=True):
+    """ {facet: Counter} computed from the base tables, optionally filtered """
+    ids = matching_ids(filters) if filters else None
+
+    taxa_q = select(Taxa.value, func.count(Reptile.id)).select_from(Reptile).join(Taxa, Reptile.taxa_id == Taxa.id)
+    year_q = select(Reptile.subspecies_year, func.count(Reptile.id)).where(Reptile.subspecies_year.is_not(None))
+    if ids is not None:
+        taxa_q = taxa_q.where(Reptile.id.in_(ids))
+        year_q = year_q.where(Reptile.id.in_(ids))
+
+    return {
+        "taxa": Counter(dict(session.execute(taxa_q.group_by(Taxa.value)).all())),
+        "year": Counter({str(y): n for y, n in session.execute(year_q.group_by(Reptile.subspecies_year))}),
+        "country": _country_counts(session, ids) if countries else Counter(),
+    }
+
+
+def rebuild_facets(session, countries=True):
+    """ recompute the facet_counts table from scratch; the country counts need the regions tables """
+    session.query(FacetCount).delete()
+    counts = compute_counts(session, countries=countries)
+    session.add_all(FacetCount(facet=facet, value=str(value)[:255], count=n)
+                    for facet in FACETS for value, n in counts[facet].items())
+    session.flush()
+    return counts
+
+
+def _top(counter, limit):
+    return [{"value": value, "count": n} for value, n in counter.most_common(limit)]
+
+
+def get_facets(session, filters=None, limit=50):
+    """ facet counts for the given filters, served from aggregates when unfiltered """
+    if not filters:
+        result = {}
+        for facet in FACETS:
+            rows = session.query(FacetCount.value, FacetCount.count).filter(
+                FacetCount.facet == facet
+            ).order_by(FacetCount.count.desc(), FacetCount.value).limit(limit).all()
+            result[facet] = [{"value": value, "count": n} for value, n in rows]
+        if any(result.values()):
+            return result
+    counts = compute_counts(session, filters)
+    return {facet: _top(counts[facet], limit) for facet in FACETS}
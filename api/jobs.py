@@ -0,0 +1,358 @@
+"""
+Background jobs for maintenance work that should not run on a request thread.
+
+Jobs are rows in the jobs table, so they are written in the same
+transaction as the change that needs them and survive restarts.  Each API
+worker runs a JobRunner: a dispatcher thread that claims due jobs with an
+atomic UPDATE (status queued -> running, so two workers never take the
+same job) and hands them to a small thread pool.
+
+A job may carry a key.  While a job with that key is still queued, a
+second enqueue with the same key returns the queued job instead of adding
+another one (queued_key is unique and only set while queued), so a burst
+of writes asking for ANALYZE produces a single run.
+
+The dispatcher refreshes heartbeat_at (and the reported progress) of its
+running jobs on every poll.  Running jobs whose heartbeat is older than
+STALE_AFTER belonged to a process that died; they are queued again, up to
+MAX_ATTEMPTS attempts.
+
+Usage (from the api directory):
+
+    python jobs.py status
+    python jobs.py run              # work off the due jobs in this process
+    python jobs.py prune --days 7
+"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from sqlalchemy import select, insert, update, delete, or_, text
+
+from models import Base, Job
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+REBUILD_FACETS, REBUILD_TAXONOMY, REBUILD_REGIONS, REBUILD_NAMES, ANALYZE = (
+    "rebuild_facets", "rebuild_taxonomy", "rebuild_regions", "rebuild_names", "analyze")
+# full rebuilds run after a load
+REBUILD_JOBS = (REBUILD_FACETS, REBUILD_TAXONOMY, REBUILD_NAMES)
+
+ANALYZE_DELAY = 60.0
+STALE_AFTER = 120.0
+RECOVER_EVERY = 30.0
+RETRY_DELAY = 30.0
+MAX_ATTEMPTS = 3
+ERROR_BACKOFF = 30.0
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """ register fn(session, params, progress) as the handler of kind; the runner commits afterwards """
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+@handler(REBUILD_FACETS)
+def _rebuild_facets(session, params, progress):
+    """ regions first, the country counts are read from them """
+    from regions import rebuild_regions
+    from facets import rebuild_facets
+    rebuild_regions(session)
+    rebuild_facets(session)
+
+
+@handler(REBUILD_TAXONOMY)
+def _rebuild_taxonomy(session, params, progress):
+    from taxonomy import rebuild_taxonomy
+    rebuild_taxonomy(session)
+
+
+@handler(REBUILD_REGIONS)
+def _rebuild_regions(session, params, progress):
+    from regions import rebuild_regions
+    rebuild_regions(session)
+
+
+@handler(REBUILD_NAMES)
+def _rebuild_names(session, params, progress):
+    from resolve import rebuild_names
+    rebuild_names(session)
+
+
+@handler(ANALYZE)
+def _analyze(session, params, progress):
+    """ refresh the planner statistics """
+    if session.get_bind().dialect.name != "mysql":
+        session.execute(text("ANALYZE"))
+        return
+    tables = [table.name for table in Base.metadata.sorted_tables]
+    for done, name in enumerate(tables, 1):
+        session.execute(text(f"ANALYZE TABLE {name}"))
+        progress(done, len(tables), name)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(session, kind, key=None, params=None, delay=0):
+    """ add a job (the caller commits), returns its id; with a key an already queued job is reused """
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    now = _now()
+    row = {"kind": kind, "job_key": key, "queued_key": key, "status": QUEUED, "attempts": 0, "progress": 0,
+           "params": json.dumps(params) if params else None, "created_at": now,
+           "run_after": now + timedelta(seconds=delay) if delay else None}
+    if key is None:
+        return session.execute(insert(Job).values(row)).inserted_primary_key[0]
+    # a concurrent enqueue of the same key loses on the unique queued_key, without failing the caller
+    session.execute(insert(Job).values(row).prefix_with("OR IGNORE", dialect="sqlite")
+                    .prefix_with("IGNORE", dialect="mysql"))
+    return session.execute(select(Job.id).where(Job.queued_key == key)).scalar()
+
+
+def job_summary(job):
+    """ JSON-ready description of a job row """
+    stamp = lambda value: value.isoformat() if value else None
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "key": job.job_key,
+        "params": json.loads(job.params) if job.params else None,
+        "status": job.status,
+        "attempts": job.attempts,
+        "progress": job.progress,
+        "total": job.total,
+        "message": job.message,
+        "worker": job.worker,
+        "run_after": stamp(job.run_after),
+        "created_at": stamp(job.created_at),
+        "started_at": stamp(job.started_at),
+        "finished_at": stamp(job.finished_at),
+    }
+
+
+def list_jobs(session, status=None, limit=50):
+    """ newest jobs first """
+    query = select(Job).order_by(Job.id.desc()).limit(limit)
+    if status:
+        query = query.where(Job.status == status)
+    return [job_summary(job) for job in session.execute(query).scalars()]
+
+
+def _requeue(session, job, message):
+    """ put a running job back in the queue, or give up on it """
+    now = _now()
+    values = {"worker": None, "message": message[:1024]}
+    if job.attempts >= MAX_ATTEMPTS:
+        values.update(status=FAILED, finished_at=now)
+    elif job.job_key and session.execute(select(Job.id).where(Job.queued_key == job.job_key)).scalar():
+        # a newer job with the same key will do the work
+        values.update(status=CANCELLED, finished_at=now)
+    else:
+        values.update(status=QUEUED, queued_key=job.job_key,
+                      run_after=now + timedelta(seconds=RETRY_DELAY * job.attempts))
+    session.execute(update(Job).where(Job.id == job.id, Job.status == RUNNING).values(values))
+
+
+def requeue_stale(session):
+    """ queue again the running jobs whose worker stopped sending heartbeats, returns how many """
+    cutoff = _now() - timedelta(seconds=STALE_AFTER)
+    stale = session.execute(select(Job).where(Job.status == RUNNING, Job.heartbeat_at < cutoff)).scalars().all()
+    for job in stale:
+        logger.warning(f"job {job.id} ({job.kind}) lost its worker {job.worker}")
+        _requeue(session, job, f"worker {job.worker} stopped")
+    return len(stale)
+
+
+def prune_jobs(session, older_than):
+    """ delete finished jobs older than the given timedelta """
+    cutoff = _now() - older_than
+    result = session.execute(delete(Job).where(Job.status.in_([DONE, FAILED, CANCELLED]),
+                                               Job.finished_at < cutoff))
+    return result.rowcount
+
+
+class JobRunner:
+    """ per-process dispatcher thread plus a thread pool """
+
+    def __init__(self, threads=2, interval=2.0):
+        self.threads = threads
+        self.interval = interval
+        self.worker_id = None
+        self._running = {}      # job id -> (progress, total, message) reported by the handler
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+        self._last_recover = 0.0
+
+    def start(self):
+        """ start the dispatcher in this process (once) """
+        if self.threads <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self.worker_id = _worker_id()
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="reptiledb-job")
+        self._thread = threading.Thread(target=self._dispatch, name="reptiledb-jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+    def _session(self):
+        from database import get_db_session
+        return get_db_session()
+
+    def _dispatch(self):
+        delay = 0
+        while not self._stop.wait(delay):
+            try:
+                self.tick()
+                delay = self.interval
+            except Exception:
+                logger.exception("job dispatcher failed")
+                delay = ERROR_BACKOFF
+
+    def tick(self):
+        """ one dispatcher round: heartbeat, recover stale jobs, start due jobs """
+        session = self._session()
+        try:
+            self._heartbeat(session)
+            if time.monotonic() - self._last_recover >= RECOVER_EVERY:
+                self._last_recover = time.monotonic()
+                requeue_stale(session)
+                session.commit()
+            with self._lock:
+                free = self.threads - len(self._running)
+            for job_id in self.claim(session, free):
+                self._pool.submit(self.run, job_id)
+        finally:
+            session.close()
+
+    def _heartbeat(self, session):
+        with self._lock:
+            running = dict(self._running)
+        now = _now()
+        for job_id, (done, total, message) in running.items():
+            values = {"heartbeat_at": now, "progress": done, "total": total}
+            if message is not None:
+                values["message"] = message[:1024]
+            session.execute(update(Job).where(Job.id == job_id, Job.status == RUNNING).values(values))
+        if running:
+            session.commit()
+
+    def claim(self, session, limit):
+        """ atomically take up to limit due jobs, oldest first, returns their ids """
+        if limit <= 0:
+            return []
+        now = _now()
+        candidates = session.execute(
+            select(Job.id).where(Job.status == QUEUED, or_(Job.run_after.is_(None), Job.run_after <= now))
+            .order_by(Job.id).limit(limit)
+        ).scalars().all()
+        claimed = []
+        for job_id in candidates:
+            result = session.execute(
+                update(Job).where(Job.id == job_id, Job.status == QUEUED)
+                .values(status=RUNNING, queued_key=None, worker=self.worker_id or _worker_id(),
+                        started_at=now, heartbeat_at=now, attempts=Job.attempts + 1)
+            )
+            session.commit()
+            if result.rowcount == 1:
+                claimed.append(job_id)
+                with self._lock:
+                    self._running[job_id] = (0, None, None)
+        return claimed
+
+    def run(self, job_id):
+        """ run one claimed job and record how it ended """
+        session = self._session()
+        try:
+            job = session.get(Job, job_id)
+            params = json.loads(job.params) if job.params else {}
+
+            def progress(done, total=None, message=None):
+                with self._lock:
+                    self._running[job_id] = (done, total, message)
+
+            logger.info(f"job {job_id}: {job.kind} started")
+            HANDLERS[job.kind](session, params, progress)
+            done, total, _ = self._running.get(job_id, (0, None, None))
+            session.execute(update(Job).where(Job.id == job_id).values(
+                status=DONE, finished_at=_now(), progress=total or done, total=total, message=None))
+            session.commit()
+            logger.info(f"job {job_id}: {job.kind} done")
+        except Exception as e:
+            session.rollback()
+            logger.exception(f"job {job_id} failed")
+            try:
+                _requeue(session, session.get(Job, job_id), f"{type(e).__name__}: {e}")
+                session.commit()
+            except Exception:
+                session.rollback()
+                logger.exception(f"could not record the failure of job {job_id}")
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+            session.close()
+
+    def run_pending(self):
+        """ work off the due jobs in the calling thread, returns how many ran """
+        ran = 0
+        while True:
+            session = self._session()
+            try:
+                claimed = self.claim(session, 1)
+            finally:
+                session.close()
+            if not claimed:
+                return ran
+            self.run(claimed[0])
+            ran += 1
+
+
+job_runner = JobRunner()
+
+
+if __name__ == "__main__":
+    from database import get_db_session
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "run":
+        print(f"{job_runner.run_pending()} jobs run")
+    elif command == "prune" and len(sys.argv) == 4 and sys.argv[2] == "--days":
+        session = get_db_session()
+        try:
+            removed = prune_jobs(session, timedelta(days=float(sys.argv[3])))
+            session.commit()
+        finally:
+            session.close()
+        print(f"{removed} jobs removed")
+    elif command == "status":
+        session = get_db_session()
+        try:
+            for job in list_jobs(session):
+                print(f"{job['id']:>6} {job['kind']:<18} {job['status']:<10} {job['progress']}/{job['total'] or '-'} "
+                      f"{job['message'] or ''}")
+        finally:
+            session.close()
+    else:
+        print("usage: python jobs.py [status|run|prune --days N]")
+        sys.exit(1)
@@ -1,19 +1,40 @@
-import csv
-import chardet
+import os
+import json
 import sys
 from loguru import logger
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import update
 
 # Import your SQLAlchemy session factory and model classes
-from database import Session,session
-from models import Reptile, Synonym, Comment, Common_Name, Distribution, Diagnosis, External_Link, Specimen, Etymology, Taxa, Biblio, load_file, AdminUser
+from database import get_db_session
+from jobs import job_runner, enqueue, REBUILD_JOBS, ANALYZE
+from dedupe import child_values
+from changes import record_reload
+from models import Base, Reptile, Synonym, Comment, Common_Name, Distribution, Diagnosis, External_Link, Specimen, Etymology, Taxa, Biblio, AdminUser, TaxonNode
+
+# the source files and their reader are shared with the decoder in ../db
+DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "db")
+sys.path.insert(0, DB_DIR)
+from utils import load_file
+
+with open(os.path.join(DB_DIR, "config.json")) as f:
+    config = json.load(f)
+source_database_txt = os.path.join(DB_DIR, config["database"])
+source_bibliography_txt = os.path.join(DB_DIR, config["bibliography"])
+# python load_data.py [DATABASE.txt BIBLIOGRAPHY.txt] loads other files than config.json names
+if len(sys.argv) == 3:
+    source_database_txt, source_bibliography_txt = sys.argv[1:3]
+
+# everything else is rebuilt from the source files
+KEPT_TABLES = ("admin_users", "jobs", "reptile_changes", "schema_version")
+
+raw_db = load_file( source_database_txt )
+raw_bib = load_file( source_bibliography_txt)
+
+def load_biblio( session, row ):
+    """ load a bibliography record into table """
+    biblio = Biblio( row )
+    session.add(biblio)
 
-source_database_txt = "reptile_database_2023_09.txt"
-source_bibliography_txt = "reptile_database_bibliography_2023_09.txt"
-
-#raw_db = load_file( source_database_txt )
-#raw_bib = load_file( source_bibliography_txt)
-                     
 def load_reptile( session, row ):
     """ load a reptile into table """
 
@@ -24,7 +45,7 @@ def load_reptile( session, row ):
     # Clean up and split the bibliographies
     bibs = row[14].replace("\x1d", "").split("\x0b")
     # Loop over array.
-    for bib in bibs:
+    for bib in dict.fromkeys(bibs):
         # check if ID is found in biblio DB
         found_bib = (
             session.query(Biblio)
@@ -38,8 +59,8 @@ def load_reptile( session, row ):
         # If found, make the connections between the records.
         # This represents the SQLAlchemy magic.
         else:
+            # back_populates links found_bib.reptiles as well
             reptile.bibliography.append(found_bib)
-            found_bib.reptiles.append(reptile)
 #            session.commit()
 
     # Working with higher-taxa
@@ -49,7 +70,7 @@ def load_reptile( session, row ):
     # If not found, add a new record to taxa table
     if found_taxa is None:
        # logger.debug(f"Adding new taxa: {higher_taxa}")
-        found_taxa = Taxa(value=row[0])
+        found_taxa = Taxa([row[0]])
         session.add(found_taxa)
 #        session.commit()
     # connect reptile and taxa
@@ -59,7 +80,7 @@ def load_reptile( session, row ):
     # Working with synonyms
     synonyms = row[6].replace("\u001d","").split("\u000b")
     if synonyms is not None:
-        for syn in synonyms:
+        for syn in child_values(Synonym, synonyms):
             new_syn = Synonym( syn )
             session.add(new_syn)
 #            session.commit()
@@ -68,7 +89,7 @@ def load_reptile( session, row ):
     # Working with common names
     names = row[8].replace("\u001d","").split("\u000b")
     if names is not None:
-        for name in names:
+        for name in child_values(Common_Name, names):
             if len(name)>0:
                 new_name = Common_Name( name )
                 session.add(new_name)
@@ -78,7 +99,7 @@ def load_reptile( session, row ):
     # Working with distributions
     distributions = row[9].replace("\u001d","").split("\u000b")
     if distributions is not None:
-        for dist in distributions:
+        for dist in child_values(Distribution, distributions):
             if len(dist)>0:
                 new_dist = Distribution( dist )
                 session.add(new_dist)
@@ -87,7 +108,7 @@ def load_reptile( session, row ):
     # Working with comments
     comments = row[10].replace("\u001d","").split("\u000b")
     if comments is not None:
-        for comm in comments:
+        for comm in child_values(Comment, comments):
             if len(comm)>0:
                 new_comm = Comment( comm )
                 session.add(new_comm)
@@ -97,7 +118,7 @@ def load_reptile( session, row ):
     # Working with diagnoses
     diagnoses = row[11].replace("\u001d","").split("\u000b")
     if diagnoses is not None:
-        for diag in diagnoses:
+        for diag in child_values(Diagnosis, diagnoses):
             if len(diag)>0:
                 new_diag = Diagnosis( diag )
                 session.add(new_diag)
@@ -106,7 +127,7 @@ def load_reptile( session, row ):
     # Working with external_links
     urls = row[13].replace("\u001d","").split("\u000b")
     if urls is not None:
-        for url in urls:
+        for url in child_values(External_Link, urls):
             if len(url)>0:
                 new_url = External_Link( url )
                 session.add(new_url)
@@ -115,7 +136,7 @@ def load_reptile( session, row ):
     # Working with etymologies
     etymologies = row[15].replace("\u001d","").split("\u000b")
     if etymologies is not None:
-        for ety in etymologies:
+        for ety in child_values(Etymology, etymologies):
             if len(ety)>0:
                 new_ety = Etymology( ety )
                 session.add(new_ety)
@@ -124,18 +145,38 @@ def load_reptile( session, row ):
     # Working with specimens
     specimens = row[12].replace("\u001d","").split("\u000b")
     if specimens is not None:
-        for spec in specimens:
+        for spec in child_values(Specimen, specimens):
             if len(spec)>0:
                 new_spec = Specimen( spec )
                 session.add(new_spec)
                 reptile.specimens.append( new_spec )
-    
+
+    return reptile
 
 #    session.commit()
 
-# Clear out the old table before loading.  This minimizes primary key errors
+session = get_db_session()
+
+# Clear out the old tables before loading.  This minimizes primary key errors.
+# Links, children and derived tables go first so no foreign key is left dangling;
+# sqlite reuses freed reptile ids, so stale child rows would collide with new ones.
 
-session.query(Reptile).delete()
+# the self reference would block deleting taxon_nodes in one statement on MySQL
+session.execute(update(TaxonNode).values(parent_id=None))
+for table in reversed(Base.metadata.sorted_tables):
+    if table.name not in KEPT_TABLES:
+        session.execute(table.delete())
+
+# the bibliography goes first, reptiles are linked to it as they load
+logger.debug(f"bibliography rows to process: {len(raw_bib)}")
+
+for i,row in enumerate(raw_bib):
+    try:
+        load_biblio( session, row )
+    except ValueError as e:
+        logger.warning(f"bib record {i}: {e}")
+
+session.flush()
 
 logger.debug(f"rows to process: {len(raw_db)}")
 
@@ -148,10 +189,6 @@ for i,row in enumerate(raw_db):
     if i % 100 == 0:
         logger.debug(f"{i:5}")
 
-    if (True and not i<300):
-       # logger.warning(f"TESTING: subset of records loaded.  See line referenced by this warning.")
-       break
-        
 # Admin setup
 new_admin_username = 'Peter'
 new_admin_password = 'Password1'
@@ -166,4 +203,13 @@ if not existing_admin_user:
 else:
     logger.info("Admin user already exists.")
 
+# Rebuild search aggregates for the freshly loaded rows; they are queued with
+# the load and run after the commit, or by an API worker if the loader stops
+session.flush()
+for kind in REBUILD_JOBS + (ANALYZE,):
+    enqueue(session, kind, key=kind)
+# tell running API workers to drop their caches
+record_reload(session)
+
 session.commit()
+job_runner.run_pending()
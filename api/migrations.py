@@ -0,0 +1,292 @@
+"""
+Versioned schema migrations for existing databases.
+
+The loader in ../db builds the original schema.  Tables and indexes that
+were added to models.py afterwards are brought into an existing database
+by the numbered steps below.  Applied steps are recorded in the
+schema_version table, and every step is idempotent (checkfirst), so
+running upgrade against a database created by create_all() simply stamps
+it.
+
+Usage (from the api directory):
+
+    python migrations.py status
+    python migrations.py upgrade
+    python migrations.py downgrade 0
+"""
+import sys
+from datetime import datetime, timezone
+
+from loguru import logger
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import Session
+
+from models import Base, SchemaVersion
+
+
+def _table(name):
+    return Base.metadata.tables[name]
+
+
+def _index(table, name):
+    for index in _table(table).indexes:
+        if index.name == name:
+            return index
+    raise KeyError(f"index {name} not defined on {table}")
+
+
+def create_tables(*names):
+    """ step helpers: create whole tables (with their indexes) """
+    def upgrade(conn):
+        for name in names:
+            _table(name).create(conn, checkfirst=True)
+
+    def downgrade(conn):
+        for name in reversed(names):
+            _table(name).drop(conn, checkfirst=True)
+    return upgrade, downgrade
+
+
+def create_indexes(*pairs):
+    """ step helpers: create (table, index name) pairs declared in models.py """
+    def upgrade(conn):
+        existing = {}
+        for table, name in pairs:
+            if table not in existing:
+                existing[table] = {ix["name"] for ix in inspect(conn).get_indexes(table)}
+            if name not in existing[table]:
+                logger.info(f"creating index {name} on {table}")
+                _index(table, name).create(conn)
+
+    def downgrade(conn):
+        for table, name in reversed(pairs):
+            if name in {ix["name"] for ix in inspect(conn).get_indexes(table)}:
+                _index(table, name).drop(conn)
+    return upgrade, downgrade
+
+
+def plain_indexes(*specs):
+    """ step helpers: (table, index name, columns) indexes that models.py no longer declares """
+    def upgrade(conn):
+        for table, name, columns in specs:
+            if name not in {ix["name"] for ix in inspect(conn).get_indexes(table)}:
+                logger.info(f"creating index {name} on {table}")
+                conn.exec_driver_sql(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+
+    def downgrade(conn):
+        for table, name, _ in reversed(specs):
+            if name in {ix["name"] for ix in inspect(conn).get_indexes(table)}:
+                logger.info(f"dropping index {name} on {table}")
+                on_table = f" ON {table}" if conn.dialect.name == "mysql" else ""
+                conn.exec_driver_sql(f"DROP INDEX {name}{on_table}")
+    return upgrade, downgrade
+
+
+def reverse(pair):
+    """ step helper: undo an earlier step as part of a later one """
+    step_up, step_down = pair
+    return step_down, step_up
+
+
+def add_columns(table, *names):
+    """ step helper: add columns declared in models.py to an existing table """
+    def upgrade(conn):
+        existing = {c["name"] for c in inspect(conn).get_columns(table)}
+        for name in names:
+            if name not in existing:
+                column = _table(table).c[name]
+                logger.info(f"adding column {name} to {table}")
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}")
+
+    def downgrade(conn):
+        existing = {c["name"] for c in inspect(conn).get_columns(table)}
+        for name in reversed(names):
+            if name in existing:
+                conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN {name}")
+    return upgrade, downgrade
+
+
+def primary_key(table):
+    """ step helper: recreate a table whose primary key models.py now declares, keeping its distinct rows """
+    def upgrade(conn):
+        columns = [c.name for c in _table(table).primary_key]
+        if inspect(conn).get_pk_constraint(table)["constrained_columns"] == columns:
+            return
+        logger.info(f"adding primary key ({', '.join(columns)}) to {table}")
+        if conn.dialect.name != "mysql":
+            # sqlite index names are global, the old ones would clash with the new table's
+            for ix in inspect(conn).get_indexes(table):
+                conn.exec_driver_sql(f"DROP INDEX {ix['name']}")
+        conn.exec_driver_sql(f"ALTER TABLE {table} RENAME TO {table}_old")
+        _table(table).create(conn)
+        names = ", ".join(columns)
+        not_null = " AND ".join(f"{name} IS NOT NULL" for name in columns)
+        conn.exec_driver_sql(f"INSERT INTO {table} ({names}) SELECT DISTINCT {names} FROM {table}_old WHERE {not_null}")
+        conn.exec_driver_sql(f"DROP TABLE {table}_old")
+
+    def downgrade(conn):
+        pass    # the key only keeps out duplicates, older code works with it
+    return upgrade, downgrade
+
+
+def populate(builder):
+    """ step helper: fill a derived table from the base tables """
+    def upgrade(conn):
+        session = Session(bind=conn)
+        builder(session)
+        session.flush()
+
+    def downgrade(conn):
+        pass
+    return upgrade, downgrade
+
+
+def steps(*pairs):
+    """ step helper: run several (upgrade, downgrade) pairs as one step """
+    def upgrade(conn):
+        for step_up, _ in pairs:
+            step_up(conn)
+
+    def downgrade(conn):
+        for _, step_down in reversed(pairs):
+            step_down(conn)
+    return upgrade, downgrade
+
+
+def _rebuild_facets(session):
+    from facets import rebuild_facets
+    # the regions tables only exist from step 5 on; step 11 adds the country counts
+    rebuild_facets(session, countries=False)
+
+
+def _rebuild_regions_and_facets(session):
+    from regions import rebuild_regions
+    from facets import rebuild_facets
+    rebuild_regions(session)
+    rebuild_facets(session)
+
+
+def _rebuild_taxonomy(session):
+    from taxonomy import rebuild_taxonomy
+    rebuild_taxonomy(session)
+
+
+def _rebuild_regions(session):
+    from regions import rebuild_regions
+    rebuild_regions(session)
+
+
+def _rebuild_names(session):
+    from resolve import rebuild_names
+    rebuild_names(session)
+
+
+def _dedupe_children(session):
+    from dedupe import dedupe_children
+    for table, removed in dedupe_children(session).items():
+        logger.info(f"removed {removed} duplicate rows from {table}")
+
+
+CHILD_TABLES = ["synonyms", "column7", "comments", "common_names", "distributions",
+                "diagnoses", "external_links", "specimens", "etymologies"]
+
+# added by step 2, superseded by the (reptile_id, value_hash) unique indexes of step 6
+CHILD_REPTILE_INDEXES = [(table, f"ix_{table}_reptile_id", ("reptile_id",)) for table in CHILD_TABLES]
+
+# (version, description, (upgrade, downgrade))
+MIGRATIONS = [
+    (1, "facet_counts aggregate table", steps(create_tables("facet_counts"), populate(_rebuild_facets))),
+    (2, "child table reptile_id and reptile search column indexes", steps(
+        plain_indexes(*CHILD_REPTILE_INDEXES),
+        create_indexes(
+            ("reptiles", "ix_reptiles_subspecies_finder"),
+            ("reptiles", "ix_reptiles_subspecies_year"),
+            ("reptiles", "ix_reptiles_taxa_id"),
+        ),
+    )),
+    (3, "taxon_nodes taxonomy tree", steps(create_tables("taxon_nodes"), populate(_rebuild_taxonomy))),
+    (4, "bibliography author/year indexes and full-text indexes", create_indexes(
+        ("bibliography", "ix_bibliography_bib_year"),
+        ("bibliography", "ix_bibliography_bib_authors"),
+        ("bibliography", "ft_bibliography_title_authors"),
+        ("bibliography", "ft_bibliography_authors"),
+    )),
+    (5, "regions and reptile_regions distribution index",
+     steps(create_tables("regions", "reptile_regions"), populate(_rebuild_regions))),
+    (6, "child table value_hash, duplicate cleanup and (reptile_id, value_hash) unique indexes", steps(
+        *[add_columns(table, "value_hash") for table in CHILD_TABLES],
+        populate(_dedupe_children),
+        create_indexes(*[(table, f"uq_{table}_reptile_value") for table in CHILD_TABLES]),
+        # the unique indexes lead with reptile_id, so the step 2 indexes only cost writes now
+        reverse(plain_indexes(*CHILD_REPTILE_INDEXES)),
+    )),
+    (7, "admin_users table", create_tables("admin_users")),
+    (8, "reptile_changes change log", create_tables("reptile_changes")),
+    (9, "name_keys synonym resolution index", steps(create_tables("name_keys"), populate(_rebuild_names))),
+    (10, "jobs background job queue", create_tables("jobs")),
+    (11, "regions re-parsed (no type localities, with sub-regions), country facet counts from the regions index",
+     populate(_rebuild_regions_and_facets)),
+    (12, "reptile_biblio (reptile_id, biblio_id) primary key, duplicate links removed", primary_key("reptile_biblio")),
+    (13, "taxon_nodes lower-cased name_key index", steps(
+        add_columns("taxon_nodes", "name_key"),
+        create_indexes(("taxon_nodes", "ix_taxon_nodes_name_key")),
+        populate(_rebuild_taxonomy),
+        # lookups go through name_key now
+        reverse(plain_indexes(("taxon_nodes", "ix_taxon_nodes_name", ("name",)))),
+    )),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    SchemaVersion.__table__.create(conn, checkfirst=True)
+    return conn.execute(select(SchemaVersion.version).order_by(SchemaVersion.version.desc())).scalar() or 0
+
+
+def upgrade(engine, target=None):
+    """ apply every step above the current version, one transaction per step """
+    target = LATEST if target is None else target
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for number, description, (step_up, _) in MIGRATIONS:
+        if version < number <= target:
+            with engine.begin() as conn:
+                logger.info(f"migration {number}: {description}")
+                step_up(conn)
+                conn.execute(SchemaVersion.__table__.insert().values(
+                    version=number, description=description, applied_at=datetime.now(timezone.utc)))
+            version = number
+    return version
+
+
+def downgrade(engine, target=0):
+    """ undo steps above target, newest first """
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for number, description, (_, step_down) in reversed(MIGRATIONS):
+        if target < number <= version:
+            with engine.begin() as conn:
+                logger.info(f"reverting migration {number}: {description}")
+                step_down(conn)
+                conn.execute(SchemaVersion.__table__.delete().where(SchemaVersion.version == number))
+            version = number - 1
+    return version
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "upgrade":
+        target = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(f"schema version {upgrade(engine, target)}")
+    elif command == "downgrade":
+        print(f"schema version {downgrade(engine, int(sys.argv[2]))}")
+    else:
+        with engine.begin() as conn:
+            version = current_version(conn)
+        print(f"schema version {version} (latest {LATEST})")
+        for number, description, _ in MIGRATIONS:
+            print(f"  [{'x' if number <= version else ' '}] {number:3}  {description}")
@@ -1,16 +1,39 @@
 # Create SQLAlchemy objects
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, LargeBinary, UniqueConstraint, Text
-from sqlalchemy import create_engine
-from sqlalchemy.orm import relationship, backref, sessionmaker, Session
+import hashlib
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Table, UniqueConstraint, Text, DateTime, Index
+from sqlalchemy.orm import relationship, backref
 from sqlalchemy.orm import declarative_base
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from compression import text_column
 
 Base = declarative_base()
 
+
+def value_hash(value):
+    """ sha1 of a child value, the per-reptile uniqueness key of the child tables """
+    if value is None:
+        return None
+    return hashlib.sha1(str(value).encode("utf-8")).hexdigest()
+
+
+def _value_hash_default(context):
+    return value_hash(context.get_current_parameters().get("value"))
+
 reptile_biblio = Table(
     "reptile_biblio",
     Base.metadata,
-    Column("reptile_id", Integer, ForeignKey("reptiles.id"),index=True),
-    Column("biblio_id", String(30), ForeignKey("bibliography.bib_id"),index=True),
+    # one row per citation; the key leads with reptile_id, so that side needs no index of its own
+    Column("reptile_id", Integer, ForeignKey("reptiles.id"), primary_key=True),
+    Column("biblio_id", String(30), ForeignKey("bibliography.bib_id"), primary_key=True, index=True),
+)
+
+# reptile <-> normalized distribution region, maintained by regions.py
+reptile_regions = Table(
+    "reptile_regions",
+    Base.metadata,
+    Column("region_id", Integer, ForeignKey("regions.id"), primary_key=True),
+    Column("reptile_id", Integer, ForeignKey("reptiles.id"), primary_key=True, index=True),
 )
 
 old_reptile_taxa = Table(
@@ -26,6 +49,11 @@ class Synonym( Base ):
     id = Column(Integer, primary_key=True, autoincrement=True,index=True)
     value = Column(String(4096))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_synonyms_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = value[:4096]
@@ -38,6 +66,11 @@ class Column7( Base ):
     id = Column(Integer, primary_key=True, autoincrement=True,index=True)
     value = Column(String(255))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_column7_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = value[:255]
@@ -49,8 +82,13 @@ class Comment( Base ):
     __tablename__ = "comments"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    value = Column(String(8192))
+    value = Column(text_column("comments.value", String(8192)))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_comments_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = str(value).replace("\u001d","")[:8000]
@@ -64,6 +102,11 @@ class Common_Name( Base ):
     id = Column(Integer, primary_key=True, autoincrement=True)
     value = Column(String(4096))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_common_names_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = value[:4096]
@@ -76,6 +119,11 @@ class Distribution( Base ):
     id = Column(Integer, primary_key=True, autoincrement=True)
     value = Column(String(4096))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_distributions_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = value[:4096]
@@ -86,8 +134,13 @@ class Diagnosis( Base ):
     __tablename__ = "diagnoses"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    value = Column(Text(65336))
+    value = Column(text_column("diagnoses.value", Text(65336)))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_diagnoses_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = str(value)[:65335]
@@ -100,6 +153,11 @@ class External_Link( Base ):
     id = Column(Integer, primary_key=True, autoincrement=True)
     value = Column(String(4096))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_external_links_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = value[:4096]
@@ -112,6 +170,11 @@ class Specimen( Base ):
     id = Column(Integer, primary_key=True, autoincrement=True)
     value = Column(String(9000))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_specimens_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = str(value).replace("\u001d","")[:8900]
@@ -124,6 +187,11 @@ class Etymology( Base ):
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     value = Column(String(4096))
     reptile_id = Column( Integer, ForeignKey("reptiles.id") )
+    value_hash = Column(String(40), default=_value_hash_default)
+
+    __table_args__ = (
+        Index('uq_etymologies_reptile_value', 'reptile_id', 'value_hash', unique=True),
+    )
     
     def __init__( self, value ):
         self.value = value[:4096]
@@ -153,8 +221,8 @@ class Reptile(Base):
 #remove    higher_taxa_species = Column(String(4096))
     subspecies_1 = Column(String(255))
     subspecies_2 = Column(String(255))
-    subspecies_finder = Column(String(255))
-    subspecies_year = Column(Integer)
+    subspecies_finder = Column(String(255), index=True)
+    subspecies_year = Column(Integer, index=True)
     col05 = Column(String(255))
 #remove    synonym_string = Column(String(4096))
 #remove    col07 = Column(Text(65536))
@@ -172,8 +240,9 @@ class Reptile(Base):
     bibliography = relationship(
         "Biblio",secondary=reptile_biblio,back_populates="reptiles"
     )
-    taxa_id = Column( Integer, ForeignKey("taxa.id") )
+    taxa_id = Column( Integer, ForeignKey("taxa.id"), index=True )
     taxa = relationship('Taxa', foreign_keys=[taxa_id], uselist=False)
+    regions = relationship("Region", secondary=reptile_regions)
 
     synonyms = relationship("Synonym",backref=backref("reptiles"))
     column7s = relationship("Column7",backref=backref("reptiles"))
@@ -219,7 +288,7 @@ class Biblio( Base ):
 
     bib_id = Column(String(30), primary_key=True,index=True )
     bib_authors = Column(String(5000))
-    bib_year = Column(String(255))
+    bib_year = Column(String(255), index=True)
     bib_title = Column(Text(65536))
     bib_journal = Column(String(512))
     bib_url = Column(String(2048))
@@ -233,5 +302,148 @@ class Biblio( Base ):
         self.bib_journal = cols[4][:2048]
         self.bib_url = cols[5][:2048]
 
+    __table_args__ = (
+        Index('ix_bibliography_bib_authors', 'bib_authors', mysql_length=255),
+        Index('ft_bibliography_title_authors', 'bib_title', 'bib_authors', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        Index('ft_bibliography_authors', 'bib_authors', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
+
     def __repr__(self):
         return f"<Biblio(bib_id={self.bib_id}), {self.bib_authors} {self.bib_year}>"
+
+
+class FacetCount( Base ):
+    __tablename__ = "facet_counts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    facet = Column(String(32), nullable=False)
+    value = Column(String(255), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('facet', 'value', name='uq_facet_counts_facet_value'),
+    )
+
+    def __repr__(self):
+        return f"<FacetCount({self.facet}={self.value}), {self.count}>"
+
+
+class SchemaVersion( Base ):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255))
+    applied_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<SchemaVersion({self.version}), {self.description}>"
+
+
+class TaxonNode( Base ):
+    __tablename__ = "taxon_nodes"
+
+    # nested set over the parsed higher-taxa strings; a subtree is lft BETWEEN node.lft AND node.rgt
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(255), nullable=False)
+    # lower-cased name, so case-insensitive lookups are plain equality on an index
+    name_key = Column(String(255), index=True)
+    parent_id = Column(Integer, ForeignKey("taxon_nodes.id"), index=True)
+    depth = Column(Integer, nullable=False)
+    lft = Column(Integer, nullable=False, unique=True, index=True)
+    rgt = Column(Integer, nullable=False)
+    taxa_id = Column(Integer, ForeignKey("taxa.id"), unique=True, index=True)
+    species_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TaxonNode(id={self.id}), {self.name} [{self.lft},{self.rgt}] {self.species_count}>"
+
+
+class Region( Base ):
+    __tablename__ = "regions"
+
+    # one row per country/region name found in the distribution strings
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False)
+    key = Column(String(255), nullable=False, unique=True, index=True)
+
+    def __repr__(self):
+        return f"<Region(id={self.id}), {self.name}>"
+
+
+class NameKey( Base ):
+    __tablename__ = "name_keys"
+
+    # normalized current and synonym names, looked up by hash; maintained by resolve.py
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name_hash = Column(BigInteger, nullable=False)
+    name = Column(String(255), nullable=False)
+    kind = Column(String(16), nullable=False)
+    reptile_id = Column(Integer, ForeignKey("reptiles.id"), nullable=False, index=True)
+
+    __table_args__ = (
+        Index('ix_name_keys_hash_reptile', 'name_hash', 'reptile_id'),
+    )
+
+    def __repr__(self):
+        return f"<NameKey(id={self.id}), {self.name} -> {self.reptile_id}>"
+
+
+class ReptileChange( Base ):
+    __tablename__ = "reptile_changes"
+
+    # append-only log of writes; workers follow it by id to invalidate their caches
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    reptile_id = Column(Integer, index=True)
+    op = Column(String(16), nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+    changed_at = Column(DateTime, index=True)
+
+    def __repr__(self):
+        return f"<ReptileChange(id={self.id}), {self.op} {self.reptile_id} v{self.version}>"
+
+
+class Job( Base ):
+    __tablename__ = "jobs"
+
+    # background maintenance queue worked off by jobs.py; queued_key is the job key while queued, for dedupe
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(64), nullable=False)
+    job_key = Column(String(255), index=True)
+    queued_key = Column(String(255), unique=True)
+    params = Column(Text)
+    status = Column(String(16), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+    message = Column(String(1024))
+    worker = Column(String(128))
+    run_after = Column(DateTime)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_jobs_status_id', 'status', 'id'),
+    )
+
+    def __repr__(self):
+        return f"<Job(id={self.id}), {self.kind} {self.status}>"
+
+
+class AdminUser(Base):
+    __tablename__ = 'admin_users'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    username = Column(String(255), unique=True, nullable=False)
+    hashed_password = Column(String(255), nullable=False)
+
+    def __init__(self, username, password):
+        self.username = username
+        self.hashed_password = generate_password_hash(password)
+
+    def check_password(self, password):
+        return check_password_hash(self.hashed_password, password)
+
+    def __repr__(self):
+        return f"<AdminUser(username={self.username})>"
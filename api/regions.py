@@ -0,0 +1,137 @@
+"""
+Normalized distribution regions.
+
+Distribution strings are free text.  The country/region names found in
+them (distribution_countries), including the sub-regions listed in
+parentheses after a country, are stored once in the regions
+table under a normalized key, and reptile_regions links every reptile to
+its regions.  The advanced search resolves ``distribution=`` through the
+unique index on regions.key and the (region_id, reptile_id) primary key,
+so a country filter is an index lookup instead of a LIKE scan over every
+distribution row:
+
+    distribution=Madagascar     exact region name
+    distribution=Mada*          region names starting with "Mada"
+
+The loader rebuilds the tables after a load; the write endpoints relink
+the reptiles they touch.
+"""
+import re
+
+from sqlalchemy import select, delete, insert
+
+from models import Reptile, Distribution, Region, reptile_regions
+from autocomplete import normalize
+
+IN_CHUNK = 500
+
+# sorts after any key character, closes the key range of a prefix search
+_RANGE_END = "\uffff"
+
+# the type locality names a collecting site, not part of the range
+_TYPE_LOCALITY = re.compile(r"type\s+locality\s*:.*", re.IGNORECASE | re.DOTALL)
+# square brackets hold citations and editorial notes; parentheses hold sub-regions
+_CITATIONS = re.compile(r"\[[^\]]*\]")
+_SUBREGIONS = re.compile(r"\(([^()]*)\)")
+_COMPASS = re.compile(r"^(?:(?:[NSEWC]{1,3})(?:/[NSEWC]{1,3})*\s+)+")
+_SPLIT = re.compile(r"[,;]|\s+—\s+")
+
+
+def distribution_countries(text):
+    """ best-effort set of country/region names mentioned in a distribution string """
+    countries = set()
+    if not text:
+        return countries
+    text = _CITATIONS.sub("", _TYPE_LOCALITY.sub("", text))
+    # "Mexico (Nayarit, Jalisco)" names Mexico and its states
+    parts = _SPLIT.split(_SUBREGIONS.sub("", text))
+    for inner in _SUBREGIONS.findall(text):
+        parts.extend(_SPLIT.split(inner))
+    for part in parts:
+        part = part.split(":")[0]
+        part = _COMPASS.sub("", part.strip()).strip(" .")
+        if len(part) < 2 or len(part.split()) > 4 or not part[0].isupper():
+            continue
+        if part.isupper():
+            part = part.title()
+        countries.add(part[:255])
+    return countries
+
+
+def region_key(name):
+    return normalize(name)
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), IN_CHUNK):
+        yield values[i:i + IN_CHUNK]
+
+
+def _region_ids(session, names):
+    """ {key: region id} for names, creating the regions that are missing """
+    wanted = {}
+    for name in names:
+        wanted.setdefault(region_key(name), name)
+    wanted.pop("", None)
+    found = {}
+    for chunk in _chunks(wanted):
+        found.update(session.execute(select(Region.key, Region.id).where(Region.key.in_(chunk))).all())
+    missing = [{"key": key, "name": wanted[key]} for key in wanted if key not in found]
+    if missing:
+        session.execute(insert(Region), missing)
+        for chunk in _chunks(row["key"] for row in missing):
+            found.update(session.execute(select(Region.key, Region.id).where(Region.key.in_(chunk))).all())
+    return found
+
+
+def unlink_reptiles(session, reptile_ids):
+    """ drop the region links of the given reptiles """
+    for chunk in _chunks(reptile_ids):
+        session.execute(delete(reptile_regions).where(reptile_regions.c.reptile_id.in_(chunk)))
+
+
+def link_reptiles(session, reptile_ids):
+    """ (re)compute the region links of the given reptiles from their distributions """
+    reptile_ids = list(reptile_ids)
+    unlink_reptiles(session, reptile_ids)
+    keys = {}
+    for chunk in _chunks(reptile_ids):
+        for reptile_id, value in session.execute(
+            select(Distribution.reptile_id, Distribution.value).where(Distribution.reptile_id.in_(chunk))
+        ):
+            for name in distribution_countries(value):
+                keys.setdefault(reptile_id, {})[region_key(name)] = name
+    if not keys:
+        return
+    ids = _region_ids(session, [name for names in keys.values() for name in names.values()])
+    rows = [{"region_id": ids[key], "reptile_id": reptile_id}
+            for reptile_id, names in keys.items() for key in names if key in ids]
+    session.execute(insert(reptile_regions), rows)
+
+
+def rebuild_regions(session):
+    """ recompute regions and reptile_regions from scratch """
+    session.execute(delete(reptile_regions))
+    session.execute(delete(Region))
+    reptile_ids = session.execute(select(Reptile.id).order_by(Reptile.id)).scalars().all()
+    for chunk in _chunks(reptile_ids):
+        link_reptiles(session, chunk)
+    session.flush()
+
+
+def region_predicate(value):
+    """ Region condition for a distribution filter; a trailing * asks for a prefix match """
+    if value.endswith("*"):
+        key = region_key(value.rstrip("*"))
+        return Region.key.between(key, key + _RANGE_END)
+    return Region.key == region_key(value)
+
+
+def distribution_filter(value):
+    """ reptile condition for a distribution filter, resolved through the region index """
+    return Reptile.id.in_(
+        select(reptile_regions.c.reptile_id)
+        .join(Region, Region.id == reptile_regions.c.region_id)
+        .where(region_predicate(value))
+    )
@@ -0,0 +1,133 @@
+"""
+Exact name resolution through a normalized-name hash index.
+
+Every reptile's current name (genus + species) and each of its synonyms
+are normalized (autocomplete.normalize) and stored in name_keys under a
+64-bit hash of the normalized key.  A synonym is stored twice, once as
+written ("Tantilla lerai SMITH 1808") and once as the bare name without
+author and year ("tantilla lerai"), so callers can send either form.
+
+Resolving a name is one equality lookup on the (name_hash, reptile_id)
+index; a batch of names is a handful of IN lookups, one per chunk,
+instead of one LIKE scan per name.  The stored key is compared as well,
+so hash collisions never produce a wrong match.
+
+The loader rebuilds the table after a load; the write endpoints reindex
+the reptiles they touch.
+"""
+import hashlib
+
+from sqlalchemy import select, delete, insert
+
+from models import Reptile, Synonym, NameKey
+from autocomplete import normalize
+
+IN_CHUNK = 500
+MAX_NAMES = 5000
+
+# which match wins when one reptile is found through several keys
+KIND_ORDER = {"species": 0, "synonym": 1}
+
+
+def name_hash(key):
+    """ signed 64-bit hash of a normalized name """
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def bare_name(value):
+    """ the scientific name of a synonym without author and year: "Genus (Subgenus) species subspecies" """
+    tokens = (value or "").replace(",", " ").split()
+    if not tokens or not tokens[0][:1].isupper() or tokens[0].isupper():
+        return None
+    name = [tokens[0]]
+    for token in tokens[1:]:
+        if token.startswith("(") and token.endswith(")") and token[1:2].isupper() and not token.isupper():
+            continue    # subgenus
+        if not token[:1].islower():
+            break
+        name.append(token)
+    return " ".join(name) if len(name) > 1 else None
+
+
+def _keys(genus, species, synonyms):
+    """ {normalized key: kind} for one reptile """
+    keys = {}
+    if genus and species:
+        keys[normalize(f"{genus} {species}")] = "species"
+    for value in synonyms:
+        for name in (value, bare_name(value)):
+            key = normalize(name) if name else ""
+            if key:
+                keys.setdefault(key, "synonym")
+    return keys
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), IN_CHUNK):
+        yield values[i:i + IN_CHUNK]
+
+
+def unindex_reptiles(session, reptile_ids):
+    """ drop the name keys of the given reptiles """
+    for chunk in _chunks(reptile_ids):
+        session.execute(delete(NameKey).where(NameKey.reptile_id.in_(chunk)))
+
+
+def index_reptiles(session, reptile_ids):
+    """ (re)compute the name keys of the given reptiles """
+    reptile_ids = list(reptile_ids)
+    unindex_reptiles(session, reptile_ids)
+    rows = []
+    for chunk in _chunks(reptile_ids):
+        synonyms = {}
+        for reptile_id, value in session.execute(
+            select(Synonym.reptile_id, Synonym.value).where(Synonym.reptile_id.in_(chunk))
+        ):
+            synonyms.setdefault(reptile_id, []).append(value)
+        for reptile_id, genus, species in session.execute(
+            select(Reptile.id, Reptile.subspecies_1, Reptile.subspecies_2).where(Reptile.id.in_(chunk))
+        ):
+            rows.extend({"name_hash": name_hash(key), "name": key, "kind": kind, "reptile_id": reptile_id}
+                        for key, kind in _keys(genus, species, synonyms.get(reptile_id, [])).items())
+    if rows:
+        session.execute(insert(NameKey), rows)
+
+
+def rebuild_names(session):
+    """ recompute name_keys from scratch """
+    session.execute(delete(NameKey))
+    reptile_ids = session.execute(select(Reptile.id).order_by(Reptile.id)).scalars().all()
+    for chunk in _chunks(reptile_ids):
+        index_reptiles(session, chunk)
+    session.flush()
+
+
+def resolve_names(session, names):
+    """ {name: [{"id", "name", "match"}, ...]} for each of names, best match first """
+    keys = {}
+    for name in names:
+        keys.setdefault(normalize(name), []).append(name)
+    keys.pop("", None)
+
+    found = {}
+    by_hash = {name_hash(key): key for key in keys}
+    for chunk in _chunks(by_hash):
+        for hashed, key, kind, reptile_id in session.execute(
+            select(NameKey.name_hash, NameKey.name, NameKey.kind, NameKey.reptile_id)
+            .where(NameKey.name_hash.in_(chunk))
+        ):
+            if key == by_hash[hashed]:
+                found.setdefault(key, {}).setdefault(reptile_id, kind)
+
+    current = {}
+    for chunk in _chunks({rid for matches in found.values() for rid in matches}):
+        current.update((rid, f"{genus} {species}") for rid, genus, species in session.execute(
+            select(Reptile.id, Reptile.subspecies_1, Reptile.subspecies_2).where(Reptile.id.in_(chunk))))
+
+    result = {}
+    for name in names:
+        matches = found.get(normalize(name), {})
+        result[name] = [{"id": rid, "name": current.get(rid), "match": kind}
+                        for rid, kind in sorted(matches.items(), key=lambda m: (KIND_ORDER[m[1]], m[0]))]
+    return result
@@ -1,4 +1,182 @@
-from waitress import serve
-from API import app  # Import the Flask app from API2.py
+"""
+Production launcher: waitress in one or more worker processes.
 
-serve(app, host='0.0.0.0', port=5000)
+With --workers N > 1 the parent binds one listening socket and forks N
+workers that all accept on it, so JSON serialization runs on N cores
+instead of one.  Each worker builds its own app (and with it its own
+engine pool, caches and name index) after the fork.  SIGTERM or SIGINT to
+the parent is passed on to the workers, which stop accepting, finish
+their running and queued requests (for up to --graceful-timeout seconds)
+and exit; a worker that dies on its own is replaced.
+
+Usage (from the api directory):
+
+    python run_waitress.py --workers 4 --threads 8
+"""
+import os
+import time
+import signal
+import socket
+import argparse
+
+from loguru import logger
+from waitress import create_server, serve, wasyncore
+from waitress.server import BaseWSGIServer
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def listen_socket(host, port, backlog):
+    """ the shared listening socket, bound before any worker starts """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def _busy(socket_map):
+    """ True while a connection has a request in progress or a response left to send """
+    return any(getattr(channel, "requests", None) or getattr(channel, "total_outbufs_len", 0)
+               for channel in list(socket_map.values()))
+
+
+def drain(server, socket_map, timeout):
+    """ stop accepting, then keep serving the open requests for up to timeout seconds """
+    deadline = time.monotonic() + timeout
+    for dispatcher in list(socket_map.values()):
+        if isinstance(dispatcher, BaseWSGIServer):
+            # only this worker's copy of the shared socket; the trigger stays open for the task threads
+            wasyncore.dispatcher.close(dispatcher)
+    # responses are written by the main loop, so it keeps running while requests finish
+    while _busy(socket_map) and time.monotonic() < deadline:
+        wasyncore.loop(timeout=0.1, map=socket_map, use_poll=server.adj.asyncore_use_poll, count=1)
+    server.task_dispatcher.shutdown(cancel_pending=False, timeout=max(0.0, deadline - time.monotonic()))
+    wasyncore.close_all(socket_map)
+
+
+def run_worker(sock, args):
+    """ body of a forked worker; never returns """
+    stopping = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    status = 0
+    try:
+        # the app, and with it the engine pool and caches, is only built after the fork
+        from API import create_app
+        socket_map = {}
+        server = create_server(create_app(), map=socket_map, sockets=[sock], threads=args.threads,
+                               connection_limit=args.connection_limit, backlog=args.backlog,
+                               channel_timeout=args.channel_timeout, ident="reptiledb")
+        logger.info(f"worker {os.getpid()} serving with {args.threads} threads")
+        # not server.run(): on SystemExit it gives running requests 5 s and cancels the queued ones
+        while not stopping:
+            wasyncore.loop(timeout=server.adj.asyncore_loop_timeout, map=socket_map,
+                           use_poll=server.adj.asyncore_use_poll, count=1)
+        drain(server, socket_map, args.graceful_timeout)
+        logger.info(f"worker {os.getpid()} stopped")
+    except Exception:
+        logger.exception(f"worker {os.getpid()} failed")
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def spawn(sock, args):
+    pid = os.fork()
+    if pid == 0:
+        run_worker(sock, args)
+    return pid
+
+
+def supervise(args):
+    """ fork the workers, replace the ones that die, stop them all on SIGTERM/SIGINT """
+    # importing is cheap and connects nothing, so the workers share these pages
+    import API  # noqa: F401
+
+    sock = listen_socket(args.host, args.port, args.backlog)
+    logger.info(f"listening on {args.host}:{args.port} with {args.workers} workers")
+    workers = {spawn(sock, args) for _ in range(args.workers)}
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers and not stopping:
+        # poll: a blocking waitpid is restarted after the signal handler runs
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if not pid:
+            time.sleep(0.2)
+        elif pid in workers:
+            workers.discard(pid)
+            if not stopping:
+                logger.warning(f"worker {pid} exited with status {status}, starting a new one")
+                time.sleep(args.restart_delay)
+                workers.add(spawn(sock, args))
+
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    # the workers stop on their own within the graceful timeout; allow a moment for exiting
+    deadline = time.time() + args.graceful_timeout + 5
+    while workers and time.time() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.discard(pid)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        logger.warning(f"worker {pid} did not stop in time, killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    sock.close()
+    logger.info("all workers stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the ReptileDB API with waitress")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=_env_int("REPTILEDB_WORKERS", 1),
+                        help="worker processes (0 = one per CPU)")
+    parser.add_argument("--threads", type=int, default=_env_int("REPTILEDB_THREADS", 8),
+                        help="waitress threads per worker")
+    parser.add_argument("--connection-limit", type=int, default=100, help="open connections per worker")
+    parser.add_argument("--backlog", type=int, default=1024, help="listen backlog of the shared socket")
+    parser.add_argument("--channel-timeout", type=int, default=120, help="seconds before idle connections close")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="seconds workers get to finish their running and queued requests on shutdown")
+    parser.add_argument("--restart-delay", type=float, default=1.0)
+    args = parser.parse_args(argv)
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+
+    if args.workers == 1 or not hasattr(os, "fork"):
+        if args.workers > 1:
+            logger.warning("os.fork is not available, serving from a single process")
+        from API import create_app
+        serve(create_app(), host=args.host, port=args.port, threads=args.threads,
+              connection_limit=args.connection_limit, backlog=args.backlog, channel_timeout=args.channel_timeout)
+    else:
+        supervise(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Filter planner for the advanced reptile search.
+
+Each query parameter becomes one predicate on the reptiles table.  Child
+tables are only ever reached through EXISTS subqueries, so the result has
+one row per matching reptile without any joins or de-duplication.
+Predicates are ordered from most to least selective: equality on indexed
+reptile columns first, then exact lookups through the taxonomy tree and
+the region index (see regions.py for the distribution syntax), then
+substring matches on reptile columns and finally the child-table EXISTS
+checks.
+"""
+from sqlalchemy import select, or_, exists, union
+from sqlalchemy.orm import aliased
+
+from models import Reptile, Synonym, Common_Name, Specimen, Taxa, TaxonNode, Biblio
+from regions import distribution_filter
+from taxonomy import name_key
+
+# query parameter -> filter key
+ADVANCED_SEARCH_PARAMS = {
+    "higher-taxa": "taxa",
+    "genus": "genus",
+    "species": "species",
+    "subspecies": "subspecies",
+    "author": "author",
+    "year": "year",
+    "common-name": "common_name",
+    "distribution": "distribution",
+    "types": "types",
+    "references": "references",
+}
+
+
+def parse_filters(args):
+    """ pull advanced search filters out of request args, raises ValueError on bad input """
+    filters = {}
+    for param, key in ADVANCED_SEARCH_PARAMS.items():
+        value = args.get(param)
+        if value is None or str(value).strip() == "":
+            continue
+        filters[key] = str(value).strip()
+    if "year" in filters:
+        try:
+            filters["year"] = int(filters["year"])
+        except ValueError:
+            raise ValueError(f"year must be an integer, got {filters['year']!r}")
+    return filters
+
+
+def contains(column, text):
+    return column.ilike(f"%{text}%")
+
+
+def _year(value):
+    return Reptile.subspecies_year == value
+
+
+def _taxa(value):
+    """
+    exact first: a taxon name from the tree (everything under it, through the
+    name_key index and the nested set) or a whole higher-taxa string; only when
+    neither exists does it fall back to a substring match over taxa.value
+    """
+    node = aliased(TaxonNode)
+    by_name = (select(TaxonNode.taxa_id).join(node, TaxonNode.lft.between(node.lft, node.rgt))
+               .where(node.name_key == name_key(value), TaxonNode.taxa_id.is_not(None)))
+    by_value = select(Taxa.id).where(Taxa.value == value)
+    # uncorrelated, so the database decides it once before scanning taxa
+    fallback = select(Taxa.id).where(~exists(by_name), ~exists(by_value), contains(Taxa.value, value))
+    return Reptile.taxa_id.in_(union(by_name, by_value, fallback))
+
+
+def _author(value):
+    return contains(Reptile.subspecies_finder, value)
+
+
+def _species(value):
+    return contains(Reptile.subspecies_2, value)
+
+
+def _subspecies(value):
+    return or_(contains(Reptile.subspecies_1, value), contains(Reptile.subspecies_2, value))
+
+
+def _genus(value):
+    return or_(contains(Reptile.subspecies_1, value),
+               Reptile.synonyms.any(contains(Synonym.value, value)))
+
+
+def _common_name(value):
+    return Reptile.common_names.any(contains(Common_Name.value, value))
+
+
+def _distribution(value):
+    # exact or prefix match on the normalized region index
+    return distribution_filter(value)
+
+
+def _types(value):
+    return Reptile.specimens.any(contains(Specimen.value, value))
+
+
+def _references(value):
+    return Reptile.bibliography.any(or_(contains(Biblio.bib_authors, value),
+                                        contains(Biblio.bib_title, value)))
+
+
+# filter key -> (cost, predicate builder); lower cost runs first
+PLANNER = {
+    "year": (0, _year),
+    "taxa": (1, _taxa),
+    "author": (2, _author),
+    "species": (2, _species),
+    "subspecies": (2, _subspecies),
+    "genus": (3, _genus),
+    "common_name": (4, _common_name),
+    "distribution": (1, _distribution),
+    "types": (5, _types),
+    "references": (5, _references),
+}
+
+
+def plan(filters):
+    """ return the list of predicates for filters, most selective first """
+    steps = sorted((PLANNER[key][0], key) for key in filters if key in PLANNER)
+    return [PLANNER[key][1](filters[key]) for _, key in steps]
+
+
+def matching_ids(filters):
+    """ SELECT of reptile ids matching filters, for use as a subquery """
+    return select(Reptile.id).where(*plan(filters))
+
+
+def advanced_query(session, filters):
+    """ ORM query returning each matching reptile exactly once """
+    return session.query(Reptile).filter(*plan(filters)).order_by(Reptile.id)
@@ -0,0 +1,147 @@
+"""
+Read-only SQLite snapshots of the live database.
+
+A snapshot is a single SQLite file holding every table and index from
+models.py plus an FTS5 index over reptile names and synonyms.  It is built
+into a temporary file, ANALYZEd and VACUUMed, and then moved into place, so
+replicas can ship it as-is.  database.py opens it with
+REPTILEDB_USE_DB=SNAPSHOT (read-only, immutable, memory-mapped), which
+skips locking and change detection entirely.
+
+Admin accounts are never copied.  The source must be migrated to the latest
+schema version first.
+
+Usage (from the api directory):
+
+    python snapshot.py build reptiledb.snapshot.sqlite
+"""
+import os
+import re
+import sys
+import sqlite3
+
+from loguru import logger
+from sqlalchemy import create_engine, inspect, select, text
+
+from models import Base, SchemaVersion
+from migrations import LATEST
+
+COPY_CHUNK = 5000
+FTS_TABLE = "reptiles_fts"
+# never shipped to public replicas; /login and the admin routes answer 503 on a snapshot
+EXCLUDED_TABLES = ("admin_users",)
+
+FTS_DDL = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    "names, synonyms, tokenize = 'unicode61 remove_diacritics 2')"
+)
+FTS_FILL = f"""
+    INSERT INTO {FTS_TABLE} (rowid, names, synonyms)
+    SELECT r.id,
+           r.subspecies_1 || ' ' || r.subspecies_2,
+           coalesce((SELECT group_concat(s.value, ' ') FROM synonyms s WHERE s.reptile_id = r.id), '')
+    FROM reptiles r
+"""
+
+
+def source_version(engine):
+    """ schema version of the source database, 0 when it was never migrated """
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(SchemaVersion.__tablename__):
+            return 0
+        return conn.execute(select(SchemaVersion.version).order_by(SchemaVersion.version.desc())).scalar() or 0
+
+
+def copy_tables(source, target, chunk=COPY_CHUNK):
+    """ copy every table in models.py from source to target, streaming chunk rows at a time """
+    counts = {}
+    with source.connect() as src, target.begin() as dst:
+        src = src.execution_options(stream_results=True)
+        for table in Base.metadata.sorted_tables:
+            if table.name in EXCLUDED_TABLES:
+                continue
+            counts[table.name] = 0
+            for rows in src.execute(select(table)).partitions(chunk):
+                dst.execute(table.insert(), [row._mapping for row in rows])
+                counts[table.name] += len(rows)
+            logger.info(f"copied {counts[table.name]} rows into {table.name}")
+    return counts
+
+
+def finish_snapshot(path):
+    """ build the FTS index, gather planner statistics and compact the file """
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute(FTS_DDL)
+        conn.execute(FTS_FILL)
+        conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        conn.execute("ANALYZE")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
+
+
+def build_snapshot(source, path, chunk=COPY_CHUNK):
+    """ write a snapshot of the source engine to path, returns row counts per table """
+    version = source_version(source)
+    if version < LATEST:
+        raise ValueError(f"source is at schema version {version}, run migrations.py upgrade first")
+
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    target = create_engine(f"sqlite:///{partial}")
+    try:
+        with target.begin() as conn:
+            conn.exec_driver_sql("PRAGMA page_size = 4096")
+            conn.exec_driver_sql("PRAGMA journal_mode = OFF")
+            conn.exec_driver_sql("PRAGMA synchronous = OFF")
+            Base.metadata.create_all(conn, tables=[t for t in Base.metadata.sorted_tables
+                                                   if t.name not in EXCLUDED_TABLES])
+        counts = copy_tables(source, target, chunk)
+    finally:
+        target.dispose()
+    finish_snapshot(partial)
+    os.replace(partial, path)
+    logger.info(f"snapshot written to {path} ({os.path.getsize(path)} bytes)")
+    return counts
+
+
+def fts_terms(query):
+    """ FTS5 MATCH expression: every word of query as a quoted prefix """
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+_has_fts = {}
+
+
+def has_fts(session):
+    """ True when the bound database carries the snapshot FTS table (checked once per engine) """
+    bind = session.get_bind()
+    if bind not in _has_fts:
+        _has_fts[bind] = bind.dialect.name == "sqlite" and inspect(bind).has_table(FTS_TABLE)
+    return _has_fts[bind]
+
+
+def fts_reptile_ids(session, query):
+    """ ids of reptiles whose name or synonyms match query, None when there is no FTS index """
+    terms = fts_terms(query)
+    if not terms or not has_fts(session):
+        return None
+    return session.execute(
+        text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :terms ORDER BY rowid"),
+        {"terms": terms},
+    ).scalars().all()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "build":
+        print("usage: python snapshot.py build <output.sqlite>")
+        sys.exit(1)
+
+    from database import engine
+
+    counts = build_snapshot(engine, sys.argv[2])
+    print(f"{sys.argv[2]}: {sum(counts.values())} rows in {len(counts)} tables")
@@ -0,0 +1,192 @@
+"""
+Materialized taxonomy tree.
+
+Taxa.value holds the whole higher-taxa string, family first, for example
+"Scincidae, Eugongylinae (Eugongylini), Scincoidea, Sauria, Squamata (lizards)".
+The strings are parsed into root-to-leaf paths and merged into one tree
+stored as a nested set in taxon_nodes.  Every node keeps the number of
+species in its subtree, so "everything under Gekkonidae" is an index range
+scan on lft instead of a substring match over taxa.
+"""
+import re
+
+from sqlalchemy import select, func, or_, update
+
+from models import Reptile, Taxa, TaxonNode
+
+_SUBFAMILY = re.compile(r"(?:inae|ini)$")
+_PARENS = re.compile(r"^([^(]*?)\s*\((.*)\)\s*$")
+
+
+def _split_top_level(value):
+    """ split on commas that are not inside parentheses """
+    parts, depth, current = [], 0, []
+    for ch in value:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth = max(0, depth - 1)
+        if ch == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _expand(token):
+    """ 'Agamidae (Agaminae)' -> ['Agamidae', 'Agaminae']; 'Squamata (lizards: geckos)' -> [..., 'lizards', 'geckos'] """
+    m = _PARENS.match(token)
+    if not m:
+        return [token]
+    names = [m.group(1).strip()] if m.group(1).strip() else []
+    names.extend(n.strip() for n in re.split(r"[:;]", m.group(2)) if n.strip())
+    return names
+
+
+def parse_taxa_path(value):
+    """ root-to-leaf list of node names for a higher-taxa string """
+    tokens = _split_top_level(value or "")
+    if not tokens:
+        return []
+    family, rest = tokens[0], tokens[1:]
+    below = [t for t in rest if _SUBFAMILY.search(_expand(t)[0])]
+    above = [t for t in rest if t not in below]
+    path = []
+    for token in list(reversed(above)) + [family] + below:
+        path.extend(name[:255] for name in _expand(token))
+    return path
+
+
+def name_key(name):
+    """ the lookup key of a taxon name """
+    return str(name).strip().lower()[:255]
+
+
+def rebuild_taxonomy(session):
+    """ rebuild taxon_nodes from the taxa table and current species counts """
+    direct = dict(session.execute(
+        select(Reptile.taxa_id, func.count(Reptile.id)).where(Reptile.taxa_id.is_not(None)).group_by(Reptile.taxa_id)
+    ).all())
+
+    # trie keyed by name: {name: [children, taxa_id]}
+    root = {}
+    for taxa_id, value in session.execute(select(Taxa.id, Taxa.value)):
+        path = parse_taxa_path(value)
+        if not path:
+            continue
+        level = root
+        for name in path[:-1]:
+            level = level.setdefault(name, [{}, None])[0]
+        leaf = level.setdefault(path[-1], [{}, None])
+        if leaf[1] is None:
+            leaf[1] = taxa_id
+        else:
+            # two spellings of the same path; hang the duplicate under the first
+            leaf[0].setdefault(f"{path[-1]} [{taxa_id}]", [{}, taxa_id])
+
+    rows = []
+    counter = {"id": 0, "pos": 0}
+
+    def walk(children, parent_id, depth):
+        total = 0
+        for name in sorted(children):
+            grandchildren, taxa_id = children[name]
+            counter["id"] += 1
+            counter["pos"] += 1
+            row = {"id": counter["id"], "name": name, "name_key": name_key(name), "parent_id": parent_id, "depth": depth,
+                   "lft": counter["pos"], "taxa_id": taxa_id}
+            rows.append(row)
+            count = direct.get(taxa_id, 0) + walk(grandchildren, row["id"], depth + 1)
+            counter["pos"] += 1
+            row["rgt"] = counter["pos"]
+            row["species_count"] = count
+            total += count
+        return total
+
+    walk(root, None, 0)
+    session.query(TaxonNode).delete()
+    if rows:
+        session.execute(TaxonNode.__table__.insert(), rows)
+    return len(rows)
+
+
+def apply_taxon_counts(session, changes):
+    """ apply {taxa_id: delta} to species_count on each node and all its ancestors """
+    changes = {taxa_id: delta for taxa_id, delta in changes.items() if taxa_id is not None and delta}
+    if not changes:
+        return
+    nodes = dict((row.taxa_id, row) for row in session.execute(
+        select(TaxonNode.taxa_id, TaxonNode.lft, TaxonNode.rgt).where(TaxonNode.taxa_id.in_(list(changes)))
+    ))
+    if any(taxa_id not in nodes and delta > 0 for taxa_id, delta in changes.items()):
+        # a higher-taxa string the tree has not seen yet; the rebuild recounts everything
+        session.flush()
+        rebuild_taxonomy(session)
+        return
+    for taxa_id, delta in changes.items():
+        node = nodes.get(taxa_id)
+        if node is None:
+            continue
+        session.execute(
+            update(TaxonNode)
+            .where(TaxonNode.lft <= node.lft, TaxonNode.rgt >= node.rgt)
+            .values(species_count=TaxonNode.species_count + delta)
+        )
+
+
+def apply_taxon_count(session, taxa_id, delta):
+    """ single-taxa form of apply_taxon_counts """
+    apply_taxon_counts(session, {taxa_id: delta})
+
+
+def find_nodes(session, node):
+    """ nodes matching an id or a (case-insensitive) name """
+    query = session.query(TaxonNode)
+    if str(node).isdigit():
+        return query.filter(TaxonNode.id == int(node)).all()
+    return query.filter(TaxonNode.name_key == name_key(node)).order_by(TaxonNode.lft).all()
+
+
+def subtree_taxa_ids(nodes):
+    """ SELECT of taxa ids anywhere under the given nodes """
+    ranges = [TaxonNode.lft.between(n.lft, n.rgt) for n in nodes]
+    return select(TaxonNode.taxa_id).where(or_(*ranges), TaxonNode.taxa_id.is_not(None))
+
+
+def subtree_reptiles(session, nodes):
+    """ ORM query for every reptile under the given nodes """
+    return session.query(Reptile).filter(Reptile.taxa_id.in_(subtree_taxa_ids(nodes))).order_by(Reptile.id)
+
+
+def node_summary(node):
+    return {
+        "id": node.id,
+        "name": node.name,
+        "depth": node.depth,
+        "parent_id": node.parent_id,
+        "species_count": node.species_count,
+    }
+
+
+def taxonomy_tree(session, root=None, max_depth=None):
+    """ nested dict of the tree (or of the subtrees under root nodes) in one ordered range query """
+    query = session.query(TaxonNode).order_by(TaxonNode.lft)
+    base_depth = 0
+    if root:
+        nodes = find_nodes(session, root)
+        if not nodes:
+            return None
+        query = query.filter(or_(*[TaxonNode.lft.between(n.lft, n.rgt) for n in nodes]))
+        base_depth = min(n.depth for n in nodes)
+    if max_depth is not None:
+        query = query.filter(TaxonNode.depth <= base_depth + max_depth)
+
+    forest, by_id = [], {}
+    for node in query:
+        item = dict(node_summary(node), children=[])
+        by_id[node.id] = item
+        parent = by_id.get(node.parent_id)
+        (parent["children"] if parent else forest).append(item)
+    return forest
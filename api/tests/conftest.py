@@ -0,0 +1,96 @@
+"""
+Shared fixtures: one seeded SQLite database and one app for the whole run.
+
+The engine, the change follower, the job runner and the name index are per
+process (see database.configure), so every test talks to the same database
+and checks invariants rather than absolute numbers.  The settings are put
+into the environment before any api module is imported; load_dotenv() does
+not override them, so a local .env cannot leak into the tests.
+"""
+import os
+import sys
+import tempfile
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="reptiledb-tests-"), "tests.db")
+os.environ.update({
+    "REPTILEDB_USE_DB": "SQLITE",
+    "REPTILEDB_SQLITE": DB_PATH,
+    "REPTILEDB_SECRET_KEY": "tests-only-signing-secret",
+    "REPTILEDB_COMPRESSED_COLUMNS": "",
+    "REPTILEDB_WARMUP": "",
+    # poll the change log on every request
+    "REPTILEDB_CHANGE_POLL": "0",
+})
+
+import pytest
+
+ADMIN = {"username": "tester", "password": "tester-password"}
+
+
+@pytest.fixture(scope="session")
+def app():
+    from benchmark import seed_database
+    from database import get_db_session
+    from models import AdminUser
+    import API
+
+    seed_database(DB_PATH, reptiles=150, children=3, seed=7)
+    app = API.create_app({"REPTILEDB_JOB_THREADS": 0})
+    session = get_db_session()
+    try:
+        session.add(AdminUser(username=ADMIN["username"], password=ADMIN["password"]))
+        session.commit()
+    finally:
+        session.close()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope="session")
+def admin_headers(app):
+    response = app.test_client().post("/login", json=ADMIN)
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.get_json()['token']}"}
+
+
+@pytest.fixture
+def session(app):
+    from database import get_db_session
+    session = get_db_session()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def facet_drift(app):
+    """ fn() -> {(facet, value): (stored, live)} for every count the aggregate table gets wrong """
+    from database import get_db_session
+    from facets import compute_counts
+    from models import FacetCount
+
+    def drift():
+        session = get_db_session()
+        try:
+            stored = {(row.facet, row.value): row.count for row in session.query(FacetCount)}
+            live = {(facet, str(value)): n for facet, counts in compute_counts(session).items()
+                    for value, n in counts.items()}
+        finally:
+            session.close()
+        return {key: (stored.get(key), live.get(key)) for key in set(stored) | set(live)
+                if stored.get(key) != live.get(key)}
+    return drift
+
+
+def new_reptile(genus, species, **fields):
+    """ a valid /reptiles/add payload """
+    item = {"subspecies_1": genus, "subspecies_2": species, "subspecies_finder": "Tester",
+            "subspecies_year": 2001, "taxa": "Testidae, Sauria, Squamata (lizards)"}
+    item.update(fields)
+    return item
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import ADMIN
+
+
+def test_login_issues_a_bearer_token(client):
+    response = client.post("/login", json=ADMIN)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["token_type"] == "Bearer" and body["token"]
+
+
+def test_login_rejects_a_wrong_password(client):
+    response = client.post("/login", json={"username": ADMIN["username"], "password": "wrong"})
+    assert response.status_code == 401
+
+
+def test_login_needs_both_fields(client):
+    assert client.post("/login", json={"username": ADMIN["username"]}).status_code == 400
+
+
+def test_admin_routes_need_a_valid_token(client, admin_headers):
+    assert client.get("/jobs").status_code == 401
+    assert client.get("/jobs", headers={"Authorization": "Bearer not-a-token"}).status_code == 401
+    assert client.get("/jobs", headers=admin_headers).status_code == 200
+
+
+def test_tampered_token_is_rejected(client, admin_headers):
+    token = admin_headers["Authorization"].split()[1]
+    payload, signature = token.split(".")
+    forged = f"{payload}.{signature[::-1]}"
+    assert client.get("/jobs", headers={"Authorization": f"Bearer {forged}"}).status_code == 401
+
+
+@pytest.mark.parametrize("secret", ["change-me", "changeme", "secret"])
+def test_placeholder_secrets_are_refused(secret):
+    from auth import check_secret
+    with pytest.raises(ValueError):
+        check_secret(secret)
+
+
+def test_snapshot_answers_503_for_login_and_admin_routes(client, admin_headers, monkeypatch):
+    # the setting is read per request; the snapshot has no admin_users table to query
+    monkeypatch.setenv("REPTILEDB_USE_DB", "SNAPSHOT")
+    assert client.post("/login", json=ADMIN).status_code == 503
+    assert client.get("/jobs", headers=admin_headers).status_code == 503
+    assert client.delete("/reptiles/delete/1", headers=admin_headers).status_code == 503
+
+
+def test_tokens_expire():
+    from auth import issue_token, verify_token
+    token = issue_token("tester", ttl=60, secret=b"k", now=1000)
+    assert verify_token(token, secret=b"k", now=1059) == "tester"
+    assert verify_token(token, secret=b"k", now=1060) is None
+    assert verify_token(token, secret=b"other", now=1000) is None
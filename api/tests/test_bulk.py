@@ -0,0 +1,41 @@
+from conftest import new_reptile
+
+
+def test_bulk_add_reports_each_item(client, admin_headers, facet_drift):
+    items = [
+        new_reptile("Bulkia", "prima", distributions=["Mexico (Nayarit), Belize"]),
+        new_reptile("Bulkia", "secunda", common_names=["E: Second bulk lizard"]),
+        new_reptile("Bulkia", "prima"),                       # same species as item 0
+        {"subspecies_1": "Bulkia"},                           # required fields missing
+    ]
+    response = client.post("/reptiles/bulk", json={"reptiles": items}, headers=admin_headers)
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body["created"] == 2 and body["failed"] == 2
+    assert [r["status"] for r in body["results"]] == ["created", "created", "duplicate", "invalid"]
+    assert facet_drift() == {}
+
+    first = client.get(f"/reptiles/{body['results'][0]['id']}").get_json()
+    assert first["distributions"] == ["Mexico (Nayarit), Belize"]
+
+
+def test_bulk_add_rejects_species_already_stored(client, admin_headers):
+    item = new_reptile("Bulkia", "tertia")
+    assert client.post("/reptiles/bulk", json=[item], headers=admin_headers).status_code == 201
+    response = client.post("/reptiles/bulk", json=[item], headers=admin_headers)
+    assert response.status_code == 400
+    assert response.get_json()["results"][0]["status"] == "duplicate"
+
+
+def test_atomic_bulk_add_writes_nothing_when_an_item_fails(client, admin_headers, facet_drift):
+    items = [new_reptile("Bulkia", "quarta"), {"subspecies_1": "Bulkia"}]
+    response = client.post("/reptiles/bulk?atomic=1", json=items, headers=admin_headers)
+    assert response.status_code == 400
+    assert [r["status"] for r in response.get_json()["results"]] == ["skipped", "invalid"]
+    assert client.get("/reptiles/autocomplete?prefix=Bulkia quarta").get_json() == []
+    assert facet_drift() == {}
+
+
+def test_bulk_add_needs_a_list(client, admin_headers):
+    assert client.post("/reptiles/bulk", json={"reptiles": []}, headers=admin_headers).status_code == 400
+    assert client.post("/reptiles/bulk", json=[new_reptile("Bulkia", "x")]).status_code == 401
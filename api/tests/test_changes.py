@@ -0,0 +1,51 @@
+"""
+Writes made by another worker reach this one through the change log.
+
+The other worker is a plain session that writes and records its changes
+the way the routes do, without touching this process's name index.
+"""
+from API import track_reptile, track_reptiles, warm_up
+from bulk import bulk_add
+from changes import record_changes, CREATE, DELETE
+from conftest import new_reptile
+from models import Reptile
+from resolve import unindex_reptiles
+
+
+def _write_elsewhere(session, *items):
+    created, _ = bulk_add(session, list(items))
+    ids = [reptile.id for reptile in created]
+    track_reptiles(session, created, 1)
+    record_changes(session, ids, CREATE)
+    session.commit()
+    return ids
+
+
+def _names(client, prefix):
+    return [entry["name"] for entry in client.get(f"/reptiles/autocomplete?prefix={prefix}").get_json()]
+
+
+def test_other_workers_writes_show_up_after_a_poll(client, session):
+    assert _names(client, "Followia") == []     # builds the index
+    [reptile_id] = _write_elsewhere(session, new_reptile("Followia", "remota"))
+    assert any("remota" in name for name in _names(client, "Followia"))
+
+    reptile = session.get(Reptile, reptile_id)
+    track_reptile(session, reptile, -1)
+    unindex_reptiles(session, [reptile_id])
+    session.delete(reptile)
+    record_changes(session, [reptile_id], DELETE)
+    session.commit()
+    assert not any("remota" in name for name in _names(client, "Followia"))
+
+
+def test_writes_during_warm_up_are_not_lost(app, client, session):
+    from autocomplete import name_index
+    from changes import change_follower
+
+    change_follower.last_id = None
+    name_index.invalidate()
+    warm_up(app)
+    assert name_index.built
+    _write_elsewhere(session, new_reptile("Tepidus", "serotinus"))
+    assert any("serotinus" in name for name in _names(client, "Tepidus"))
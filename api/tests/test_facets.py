@@ -0,0 +1,47 @@
+import threading
+
+from conftest import new_reptile
+
+
+def test_stored_counts_follow_add_update_delete(client, admin_headers, facet_drift):
+    assert facet_drift() == {}
+    response = client.post("/reptiles/add", headers=admin_headers, json=new_reptile(
+        "Facetus", "novus", subspecies_year=2020, distributions=["Mexico (Nayarit), Atlantis"]))
+    assert response.status_code == 201
+    reptile_id = response.get_json()["id"]
+    assert facet_drift() == {}
+
+    assert client.patch(f"/reptiles/update/{reptile_id}", json={"distributions": ["Lemuria, Peru"], "subspecies_year": 1999},
+                        headers=admin_headers).status_code == 200
+    assert facet_drift() == {}
+
+    assert client.delete(f"/reptiles/delete/{reptile_id}", headers=admin_headers).status_code == 200
+    assert facet_drift() == {}
+
+
+def test_concurrent_adds_are_all_counted(app, admin_headers, facet_drift):
+    statuses = []
+
+    def add(worker):
+        client = app.test_client()
+        for i in range(5):
+            response = client.post("/reptiles/add", headers=admin_headers, json=new_reptile(
+                "Concurrens", f"w{worker}n{i}", subspecies_year=1888, distributions=["Madagascar"]))
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=add, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [201] * 20
+    assert facet_drift() == {}
+
+
+def test_facet_limit_is_bounded(client):
+    for limit in ("0", "-5"):
+        body = client.get(f"/reptiles/facets?limit={limit}").get_json()
+        assert all(len(values) <= 1 for values in body.values())
+    body = client.get("/reptiles/facets?limit=100000").get_json()
+    assert all(len(values) <= 500 for values in body.values())
+    assert client.get("/reptiles/facets?limit=many").status_code == 400
@@ -0,0 +1,78 @@
+"""
+load_data.py run end to end in a subprocess, against a database of its own.
+"""
+import csv
+import os
+import sqlite3
+import subprocess
+import sys
+
+from sqlalchemy import create_engine
+
+from conftest import API_DIR
+from migrations import upgrade
+from models import Base
+
+TAXA = "Squamata, Gekkonidae"
+LINK_TABLES = ("synonyms", "common_names", "distributions", "comments", "diagnoses", "external_links",
+               "etymologies", "specimens", "reptile_biblio")
+
+
+def _write(path, rows):
+    with open(path, "w", newline="", encoding="utf-16") as f:
+        csv.writer(f, delimiter="\t").writerows(rows)
+
+
+def _source_files(tmp_path):
+    bib = [[f"B{i}", "Smith, A.", "1990", f"Title {i}", "Zootaxa", f"https://example.org/{i}"] for i in range(5)]
+    db = []
+    for i in range(12):
+        # B{i % 5} is listed twice: one link per citation
+        db.append([TAXA, "Gekko", f"sp{i}", "Smith", "1990", "(Smith 1990)",
+                   f"Gekko sp{i} Smith 1990\x0bGekko sp{i} Smith 1990", "", f"E: Gecko {i}",
+                   "Madagascar, Comoros", "a comment", "a diagnosis", "Holotype: ZSM 1", "https://example.org",
+                   f"B{i % 5}\x0bB{(i + 1) % 5}\x0bB{i % 5}\x0bMISSING", "Named", str(i), str(1000 + i), "oviparous"])
+    _write(tmp_path / "db.txt", db)
+    _write(tmp_path / "bib.txt", bib)
+    return str(tmp_path / "db.txt"), str(tmp_path / "bib.txt")
+
+
+def _run(env, *args):
+    result = subprocess.run([sys.executable, *args], cwd=API_DIR, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def _counts(conn):
+    return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("reptiles", "bibliography", "taxa", "facet_counts", "taxon_nodes") + LINK_TABLES}
+
+
+def test_reload_replaces_everything_once(tmp_path):
+    database_txt, bibliography_txt = _source_files(tmp_path)
+    path = str(tmp_path / "load.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    upgrade(engine)
+    engine.dispose()
+    env = dict(os.environ, REPTILEDB_USE_DB="SQLITE", REPTILEDB_SQLITE=path)
+
+    _run(env, "load_data.py", database_txt, bibliography_txt)
+    with sqlite3.connect(path) as conn:
+        first = _counts(conn)
+    _run(env, "load_data.py", database_txt, bibliography_txt)
+    with sqlite3.connect(path) as conn:
+        second = _counts(conn)
+        duplicates = conn.execute("SELECT COUNT(*) FROM (SELECT reptile_id, biblio_id FROM reptile_biblio "
+                                  "GROUP BY reptile_id, biblio_id HAVING COUNT(*) > 1)").fetchone()[0]
+        orphans = {table: conn.execute(f"SELECT COUNT(*) FROM {table} WHERE reptile_id NOT IN "
+                                       f"(SELECT id FROM reptiles)").fetchone()[0] for table in LINK_TABLES}
+
+    assert first == second
+    assert first["reptiles"] == 12 and first["bibliography"] == 5 and first["taxa"] == 1
+    # two distinct citations each, the repeated and the unknown bib id are dropped
+    assert first["reptile_biblio"] == 24
+    # the two identical synonyms are stored once
+    assert first["synonyms"] == 12
+    assert first["facet_counts"] > 0 and first["taxon_nodes"] > 0
+    assert duplicates == 0
+    assert orphans == dict.fromkeys(LINK_TABLES, 0)
@@ -0,0 +1,53 @@
+from sqlalchemy import select
+
+from conftest import new_reptile
+
+
+def _add(client, admin_headers, genus, species, **fields):
+    response = client.post("/reptiles/add", json=new_reptile(genus, species, **fields), headers=admin_headers)
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+def _regions(session, reptile_id):
+    from models import Reptile
+    session.expire_all()
+    return sorted(region.name for region in session.get(Reptile, reptile_id).regions)
+
+
+def test_patch_distributions_moves_regions_and_facets(client, admin_headers, session, facet_drift):
+    reptile_id = _add(client, admin_headers, "Updatia", "mobilis", distributions=["Mexico (Nayarit), Belize"])
+    before = _regions(session, reptile_id)
+    assert "Belize" in before
+
+    response = client.patch(f"/reptiles/update/{reptile_id}", json={"distributions": ["Peru, Chile"]},
+                            headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()["changes"]
+    after = _regions(session, reptile_id)
+    assert "Belize" not in after and {"Peru", "Chile"} <= set(after)
+    assert facet_drift() == {}
+
+
+def test_put_and_patch_queue_an_analyze(client, admin_headers, session):
+    from jobs import ANALYZE, QUEUED
+    from models import Job
+    reptile_id = _add(client, admin_headers, "Updatia", "analysata")
+    session.execute(Job.__table__.delete().where(Job.kind == ANALYZE))
+    session.commit()
+
+    for method in (client.put, client.patch):
+        response = method(f"/reptiles/update/{reptile_id}", json={"subspecies_finder": f"Tester {method.__name__}"},
+                          headers=admin_headers)
+        assert response.status_code == 200
+        queued = session.execute(select(Job.id).where(Job.kind == ANALYZE, Job.status == QUEUED)).all()
+        assert len(queued) == 1
+        session.execute(Job.__table__.delete().where(Job.kind == ANALYZE))
+        session.commit()
+
+
+def test_update_validates_and_finds_the_reptile(client, admin_headers):
+    assert client.patch("/reptiles/update/999999", json={"subspecies_finder": "Nobody"},
+                        headers=admin_headers).status_code == 404
+    assert client.patch("/reptiles/update/1", json={"taxa": ""}, headers=admin_headers).status_code == 400
+    assert client.patch("/reptiles/update/1", json=["not", "an", "object"], headers=admin_headers).status_code == 400
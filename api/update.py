@@ -0,0 +1,137 @@
+"""
+Diff-based updates of a single reptile.
+
+Only fields present in the request are touched.  For each submitted list
+the stored rows are compared with the new values: rows whose value is no
+longer wanted (or repeats an earlier row) are deleted with one statement,
+and only the missing values are inserted.  Unchanged rows keep their ids,
+so an edit to the year leaves every child table alone.
+"""
+from sqlalchemy import insert, delete
+
+from models import Taxa, Biblio, reptile_biblio
+from bulk import CHILD_LISTS, validate_item, clean_list
+from regions import link_reptiles
+from resolve import index_reptiles
+from dedupe import child_values
+
+SCALAR_FIELDS = ("subspecies_1", "subspecies_2", "subspecies_finder", "subspecies_year",
+                 "col05", "col16", "col17", "reproduction")
+
+# fields that feed the facet and taxonomy aggregates
+AGGREGATE_FIELDS = ("taxa", "subspecies_year", "distributions")
+# fields that feed the autocomplete index
+NAME_FIELDS = ("subspecies_1", "subspecies_2", "synonyms", "common_names")
+# fields that feed the name_keys index
+RESOLVE_FIELDS = ("subspecies_1", "subspecies_2", "synonyms")
+
+
+def validate_update(data):
+    """ list of problems with a partial update (empty when valid) """
+    if not isinstance(data, dict):
+        return ["request body must be an object"]
+    errors = validate_item(dict(data))
+    # an update only needs the fields it changes, but may not blank required ones
+    return [e for e in errors if not e.endswith("is required")] + [
+        f"{field} may not be empty" for field in ("taxa", "subspecies_1", "subspecies_2", "subspecies_year")
+        if field in data and data[field] in (None, "")
+    ]
+
+
+def diff_values(current, wanted):
+    """ (ids to delete, values to insert) turning current [(id, value)] into wanted values """
+    keep = set(wanted)
+    seen = set()
+    to_delete = []
+    for row_id, value in current:
+        if value in keep and value not in seen:
+            seen.add(value)
+        else:
+            to_delete.append(row_id)
+    to_insert = [value for value in wanted if value not in seen]
+    return to_delete, to_insert
+
+
+def _update_list(session, reptile, field, values, changes):
+    attr, model = CHILD_LISTS[field]
+    wanted = child_values(model, clean_list(values))
+    current = [(row.id, row.value) for row in getattr(reptile, attr)]
+    to_delete, to_insert = diff_values(current, wanted)
+    if not to_delete and not to_insert:
+        return
+    dropped = set(to_delete)
+    removed = [value for row_id, value in current if row_id in dropped]
+    if to_delete:
+        session.execute(delete(model).where(model.id.in_(to_delete)))
+    if to_insert:
+        session.execute(insert(model), [{"reptile_id": reptile.id, "value": value} for value in to_insert])
+    session.expire(reptile, [attr])
+    changes[field] = {"added": to_insert, "removed": removed}
+
+
+def _update_bibliography(session, reptile, values, changes):
+    wanted = clean_list(values)
+    current = [bib.bib_id for bib in reptile.bibliography]
+    removed = [b for b in current if b not in wanted]
+    added = [b for b in wanted if b not in current]
+    known = {b for (b,) in session.query(Biblio.bib_id).filter(Biblio.bib_id.in_(added))} if added else set()
+    unknown = [b for b in added if b not in known]
+    added = [b for b in added if b in known]
+    if removed:
+        session.execute(delete(reptile_biblio).where(
+            reptile_biblio.c.reptile_id == reptile.id, reptile_biblio.c.biblio_id.in_(removed)))
+    if added:
+        session.execute(reptile_biblio.insert(), [{"reptile_id": reptile.id, "biblio_id": b} for b in added])
+    if removed or added:
+        session.expire(reptile, ["bibliography"])
+        changes["bibliography_ids"] = {"added": added, "removed": removed}
+    if unknown:
+        changes.setdefault("warnings", []).append(f"unknown bibliography ids: {', '.join(unknown)}")
+
+
+def apply_update(session, reptile, data):
+    """ apply the fields in data to reptile, returns a description of what changed """
+    changes = {}
+    fields = []
+
+    if "taxa" in data:
+        value = data["taxa"].strip()
+        if reptile.taxa is None or reptile.taxa.value != value:
+            taxa = session.query(Taxa).filter_by(value=value).one_or_none()
+            if taxa is None:
+                taxa = Taxa([value])
+                session.add(taxa)
+            reptile.taxa = taxa
+            fields.append("taxa")
+
+    for field in SCALAR_FIELDS:
+        if field not in data:
+            continue
+        value = data[field]
+        if field == "subspecies_year":
+            value = int(value)
+        elif value is not None:
+            value = value.strip() if field in ("subspecies_1", "subspecies_2") else value
+        if getattr(reptile, field) != value:
+            setattr(reptile, field, value)
+            fields.append(field)
+    if fields:
+        changes["fields"] = fields
+
+    for field in CHILD_LISTS:
+        if field in data:
+            _update_list(session, reptile, field, data[field], changes)
+    if "distributions" in changes:
+        link_reptiles(session, [reptile.id])
+        session.expire(reptile, ["regions"])
+    if touches(changes, RESOLVE_FIELDS):
+        session.flush()
+        index_reptiles(session, [reptile.id])
+    if "bibliography_ids" in data:
+        _update_bibliography(session, reptile, data["bibliography_ids"], changes)
+    return changes
+
+
+def touches(changes, names):
+    """ True when any of names changed """
+    return any(name in changes or name in changes.get("fields", []) for name in names)